@@ -0,0 +1,157 @@
+# Throughput and routing cost of the simulator over graph sizes and densities (average degrees)
+# usage: python Benchmarks.py [--sizes 100 1000 ...] [--degrees 4 16 ...] [--engine TICK|ACTIVE|EVENT]
+#                             [--baseline file] [--save]
+import argparse
+import json
+import platform
+import time
+from Tests import *
+from Topologies import erdosRenyi
+
+BASELINE_FILE = "benchmark_baseline.json"
+# the metrics compared against the baseline, and whether bigger is better
+METRICS = {
+    'changeTopology_nnal s': False,
+    'changeTopology_ea s': False,
+    'triggerNodesExplore s': False,
+    'ticks/s': True,
+    'packet-hops/s': True,
+    'identifyDropperBasic s': False,
+    'identifyDropperBatched s': False,
+}
+# above LARGE_N routers the dense route matrices no longer fit (three N x N ones, 40 GB 
+# at 50k), so routes are lazy and traffic only goes between TRAFFIC_HOSTS routers, 
+# whose paths are all that gets routed
+LARGE_N = 5000
+LAZY_BUDGET = 1 << 28
+TRAFFIC_HOSTS = 32
+# ticks to wait for a probe packet to drop or come back, and probes to try
+PROBE_WAIT = 400
+PROBE_TRIES = 100
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - t0
+
+def pathHops(net: Network, src: str, dst: str) -> int:
+    """Hops along the installed next hops from src to dst, 0 if there is no path."""
+    hops, cur = 0, net.getNode(src)
+    while cur.getName() != dst and hops <= net.numNodes:
+        nxt = cur.getNextHopFor(dst)
+        if nxt == None:
+            return 0
+        cur = net.getNode(nxt)
+        hops += 1
+    return hops
+
+def benchNetwork(n: int, degree: float, engine: Engine = TICK,
+                 ticks: int = 200, packetsPerTick: int = 5, seed: int = 0) -> dict:
+    random.seed(seed)
+    nodes, src, dst, weights = erdosRenyi(n, degree, seed=seed)
+    d = defaultdict(list)
+    for u, v, w in zip(src.tolist(), dst.tolist(), weights.tolist()):
+        d[nodes[u]].append((nodes[v], w))
+    large = n > LARGE_N
+    res = {'n': n, 'degree': degree, 'engine': engine.name, 'routes': 'lazy' if large else 'eager'}
+    # the bulk build alone, changeTopology_nnal also computes the routes
+    _, res['changeTopology_ea s'] = timed(Network().changeTopology_ea, nodes, src, dst, weights, False)
+    net = Network(1000, engine=engine, seed=seed)
+    if large:
+        net.setRouteStore(lazyBudget=LAZY_BUDGET)
+    hosts = random.sample(nodes, TRAFFIC_HOSTS) if large else nodes
+    _, res['changeTopology_nnal s'] = timed(net.changeTopology_nnal, nodes, d)
+    # adding a router starts the routes over, so this times a full exploration
+    attacker = Attacker('node-mal', 5)
+    net.addNode(attacker)
+    _, res['triggerNodesExplore s'] = timed(net.triggerNodesExplore)
+
+    ###traffic: random pairs, RTO long enough for every round trip to finish
+    packets = []
+    t0 = time.perf_counter()
+    for _ in range(ticks):
+        for _ in range(packetsPerTick):
+            a, b = random.sample(hosts, 2)
+            p = Packet(a, b, retransmit=False)
+            net.send(p)
+            packets.append(p)
+        net.updateTick()
+    elapsed = time.perf_counter() - t0
+    hops = sum(pathHops(net, p.dst, p.src) + pathHops(net, p.src, p.dst)
+               for p in packets if p.getStatus() == RECV)
+    res['ticks/s'] = ticks / elapsed
+    res['packet-hops/s'] = hops / elapsed
+
+    ###probing: find the attacker from a packet it dropped
+    dropped = None
+    for _ in range(PROBE_TRIES):
+        a, b = random.sample(hosts, 2)
+        p = Packet(a, b, retransmit=False)
+        net.send(p)
+        for _ in range(PROBE_WAIT):
+            if p.getStatus() == DROP or p.getStatus() == RECV:
+                break
+            net.updateTick()
+        if p.getStatus() == DROP:
+            dropped = p
+            break
+    res['identifyDropperBasic s'] = res['identifyDropperBatched s'] = None
+    if dropped != None:
+        _, res['identifyDropperBasic s'] = timed(identifyDropperBasic, net, dropped)
+        _, res['identifyDropperBatched s'] = timed(identifyDropperBatched, net, dropped)
+    return res
+
+def runSuite(sizes, degrees, engine: Engine = TICK) -> list[dict]:
+    results = []
+    for n in sizes:
+        for degree in degrees:
+            res = benchNetwork(n, degree, engine)
+            print(formatResult(res))
+            results.append(res)
+    return results
+
+def formatResult(res: dict) -> str:
+    vals = ', '.join(f"{m}: {'-' if res[m] == None else f'{res[m]:.4g}'}" for m in METRICS)
+    return f"n={res['n']} degree={res['degree']} {res['engine']}: {vals}"
+
+def saveBaseline(results: list[dict], path: str = BASELINE_FILE):
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                   'results': results}, f, indent=1)
+
+def loadBaseline(path: str = BASELINE_FILE) -> list[dict]:
+    with open(path) as f:
+        return json.load(f)['results']
+
+def compare(results: list[dict], baseline: list[dict]):
+    """Prints each metric as a ratio to the baseline run of the same configuration, >1 being better."""
+    key = lambda r: (r['n'], r['degree'], r['engine'])
+    old = {key(r): r for r in baseline}
+    for res in results:
+        base = old.get(key(res))
+        if base == None:
+            continue
+        ratios = []
+        for m, higherIsBetter in METRICS.items():
+            if not res[m] or not base.get(m):
+                continue
+            ratio = res[m] / base[m] if higherIsBetter else base[m] / res[m]
+            ratios.append(f"{m}: {ratio:.2f}x")
+        print(f"n={res['n']} degree={res['degree']} {res['engine']} vs baseline: {', '.join(ratios)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulator benchmarks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--degrees', type=float, nargs='+', default=[4, 16])
+    parser.add_argument('--engine', default='TICK', choices=[e.name for e in Engine])
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help="overwrite the baseline with this run")
+    args = parser.parse_args()
+
+    results = runSuite(args.sizes, args.degrees, Engine[args.engine])
+    try:
+        compare(results, loadBaseline(args.baseline))
+    except FileNotFoundError:
+        print("No baseline at", args.baseline)
+    if args.save:
+        saveBaseline(results, args.baseline)
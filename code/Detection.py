@@ -0,0 +1,149 @@
+# Locating droppers by probing routers through trusted prober nodes
+from NetworkObjects import *
+import numpy as np
+
+def generateTrustedNode(net: Network, to: str, name: str):
+    v = Router(name)
+    u = net.getNode(to)
+    l = Link(v.getIP(), u.getIP(), 0)
+    net.addNode(v)
+    net.addLink(l)
+    return v
+
+def suspectPath(net: Network, packet: Packet) -> list[str]:
+    """
+    Routers the packet went through, from its source on, as their recorded hops tell.
+    Stops at a router that recorded none or reports something that is not a router.
+    """
+    path, seen = [], set()
+    cur = packet.src
+    while cur not in seen and net.tryDNS(cur):
+        seen.add(cur)
+        path.append(cur)
+        cur = net.getNode(cur).reportHop(packet)
+    return path
+
+def probeRouters(net: Network, names: list[str], stopTime: int = 100, fork: bool = False) -> dict[str, bool]:
+    """
+    Tests all the given routers in one run: every router gets its own pair of
+    probers and all test packets are sent on the same tick, then the network runs
+    until each is dropped or received, for at most stopTime ticks.
+    A router passes if it does not report a hop for its test packet, as in testRouter.
+    With fork the probes run on a copy of the network.
+    """
+    if fork:
+        net = net.fork()
+    probes = {}
+    for name in names:
+        prober1 = "prober-" + str(generateRandomID())
+        prober2 = "prober-" + str(generateRandomID())
+        p1 = generateTrustedNode(net, name, prober1)
+        p2 = generateTrustedNode(net, name, prober2)
+        probes[name] = (p1, p2, Packet(prober1, prober2, retransmit=False))
+    for _, _, p in probes.values():
+        net.send(p)
+    pending = [p for _, _, p in probes.values()]
+    while stopTime and pending:
+        net.updateTick()
+        stopTime -= 1
+        pending = [p for p in pending if p.getStatus() != DROP and p.getStatus() != RECV]
+    verdicts = {name: net.getNode(name).reportHop(p) == None for name, (_, _, p) in probes.items()}
+    if not fork:
+        for p1, p2, _ in probes.values():
+            net.removeNode(p1)
+            net.removeNode(p2)
+    return verdicts
+
+def identifyDropperBatched(net: Network, packet: Packet, stopTime: int = 100, fork: bool = False) -> Router:
+    """identifyDropperBasic with every router on the packet's path probed at once."""
+    verdicts = probeRouters(net, suspectPath(net, packet), stopTime, fork)
+    for name, ok in verdicts.items():
+        if not ok:
+            return net.getNode(name)
+    return None
+
+#region group supervision
+def testGroup(net: Network, srcNode: Router, dstNode: Router, group: list[Router], fork: bool = True) -> bool:
+    """
+    Routes one packet from srcNode to dstNode through every router of the group, 
+    by chaining supervisor, group and supervisor with weight 0 links, and reports 
+    whether its round trip completed. Droppers on the chain cannot be routed around, 
+    since any other path costs more. The RTO is raised to cover the round trip.
+    Without fork the chain is set on net and undone after, as makeSupervisionGene does.
+    """
+    if fork:
+        net = net.fork()
+    chain = [srcNode] + list(group) + [dstNode]
+    if fork:
+        chain = [net.getNode(r.getName()) for r in chain]
+    pairs = [(chain[i].getIP(), chain[i + 1].getIP()) for i in range(len(chain) - 1)]
+    old = {}
+    for pair in pairs:
+        try:
+            old[pair] = net.getLink(pair).weight
+        except KeyError:
+            old[pair] = np.inf
+    net.beginTopologyEdit()
+    for u, v in pairs:
+        net.setLink(Link(u, v, 0))
+    net.commitTopologyEdit()
+    rto, stopTime = net.RTO, 2 * len(chain) + 4
+    net.RTO = max(rto, stopTime)
+    testPacket = Packet(srcNode.getName(), dstNode.getName(), retransmit=False)
+    net.send(testPacket)
+    while stopTime and testPacket.getStatus() != RECV and testPacket.getStatus() != DROP:
+        net.updateTick()
+        stopTime -= 1
+    net.RTO = rto
+    if not fork:
+        net.beginTopologyEdit()
+        for (u, v), w in old.items():
+            net.setLink(Link(u, v, w))
+        net.commitTopologyEdit()
+    return testPacket.getStatus() == RECV
+
+def superviseGroups(net: Network, srcNode: Router, dstNode: Router, 
+                    candidates: list[Router] = None, maxDroppers: int = 1, fork: bool = True):
+    """
+    Finds up to maxDroppers droppers among the candidates (every router but the 
+    supervisors by default) by adaptive group testing: a group that drops is split 
+    in halves and only the halves that can hold a dropper are tested again. 
+    A single dropper takes about log2(N) + 1 rounds, each one testGroup.
+    Returns the droppers found and the number of rounds.
+    A group can also fail without holding a dropper, through one outside it that is 
+    linked at weight 0 to two routers of the chain. A single router inferred to drop, 
+    its other half having passed, is tested on its own before it is accepted. One seen 
+    failing on its own is accepted as is, since testing it again would run the same 
+    chain, so it can be such a false positive, e.g. a router next to an Attacker.
+    """
+    if candidates == None:
+        candidates = [r for r in net.getNodes() if r is not srcNode and r is not dstNode]
+    candidates = sorted(candidates, key=Router.getName)
+    droppers = []
+    rounds = 0
+
+    def test(group):
+        nonlocal rounds
+        rounds += 1
+        return testGroup(net, srcNode, dstNode, group, fork)
+
+    def split(group, observed: bool): #the group holds a dropper, observed or inferred
+        if len(droppers) >= maxDroppers:
+            return
+        if len(group) == 1:
+            #an inferred one is confirmed, an observed one was just tested alone
+            if observed or not test(group):
+                droppers.append(group[0])
+            return
+        left, right = group[:len(group) // 2], group[len(group) // 2:]
+        if test(left):
+            split(right, False)
+            return
+        split(left, True)
+        if len(droppers) < maxDroppers and not test(right):
+            split(right, True)
+
+    if candidates and not test(candidates):
+        split(candidates, True)
+    return droppers, rounds
+#endregion
@@ -0,0 +1,29 @@
+# Monte Carlo runs of a scenario over many seeds
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import random
+
+def runTrial(scenario, seed: int):
+    """
+    Runs one trial in this process. The global random module is seeded too,
+    for the ids and graphs made before a network exists; the scenario should
+    hand the seed to its Network so the simulation gets its own RNG.
+    """
+    random.seed(seed)
+    return seed, scenario(seed)
+
+def runTrials(scenario, seeds, workers: int = None):
+    """
+    Runs scenario(seed) for every seed across a pool of processes and yields
+    (seed, result) as each trial finishes, so not in seed order.
+    The scenario has to be a module level function, to be picklable.
+    """
+    workers = os.cpu_count() if workers == None else workers
+    if workers <= 1:
+        for seed in seeds:
+            yield runTrial(scenario, seed)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(runTrial, scenario, seed) for seed in seeds]
+        for f in as_completed(futures):
+            yield f.result()
@@ -1,14 +1,20 @@
 # Definitions of network objects here
 
 #region imports
-from collections import defaultdict
-from enum import Enum
+from collections import defaultdict, OrderedDict
+from enum import Enum, IntEnum
+import gc
+import heapq
+import io
+import math
+import pickle
 import random
-from copy import deepcopy
+from time import perf_counter
+import numpy as np
 from RoutingAlgos import *
 
 #Packet status
-class Status(Enum):
+class Status(IntEnum):
     FRESH = 0
     SENT = 1
     RECV = 2
@@ -18,7 +24,7 @@ class Status(Enum):
 
 LARGE_PRIME = 112272535095293
 def generateRandomID():
-    return (random.randint(1, 2**32 - 1)) % LARGE_PRIME
+    return random.randint(1, LARGE_PRIME - 1)
 
 FRESH = Status.FRESH
 SENT = Status.SENT
@@ -27,6 +33,31 @@ RECV = Status.RECV
 DROP = Status.DROP
 PROCESSED = Status.PROCESSED
 
+#Simulation engine
+class Engine(Enum):
+    TICK = 0
+    ACTIVE = 1
+    EVENT = 2
+
+TICK = Engine.TICK
+ACTIVE = Engine.ACTIVE
+EVENT = Engine.EVENT
+
+#region router defaults, module level so that networks can be pickled
+def _noHop():
+    return None
+
+def _lookupHop(vector, name):
+    return vector[name]
+
+def _noRouting(_):
+    return None
+#endregion
+
+#Event kinds for the EVENT engine
+ARRIVE = 0
+TIMEOUT = 1
+
 #Custom error
 class CustomError(Exception):
     def __init__(self, message):
@@ -46,16 +77,27 @@ class Defender(Router): pass
 class Router:
     def __init__(self, name: str = None):
         self.__destroyed = False
-        self.__nextHopVector = defaultdict(lambda: None)
+        self.__nextHopVector = defaultdict(_noHop)
         self.__ackAwaitBuffer = set()
-        self.__recordedHop = defaultdict(lambda: None)
-        self.__completed = set()
+        # (time sent, seq, packet) min-heap over the ACK buffer. ACK'd packets 
+        # are only dropped from the buffer and their entries skipped when popped
+        self.__ackTimers = []
+        self.__ackSeq = 0
+        # packet -> (time recorded, next hop), oldest first, trimmed per the network's retention
+        self.__recordedHop = OrderedDict()
+        self.__completed = OrderedDict()
         self.__links = set()
+        # next hop -> outgoing Link, valid for __linkTable at __linkVersion of the network's topology
+        self.__outLinks = {}
+        self.__linkTable = None
+        self.__linkVersion = -1
         self.__auxiliary = None
-        self.__hopWrapper = lambda vector, name: vector[name]
+        self.__hopWrapper = _lookupHop
+        self.__routing = None
+        self.__index = -1
         self.__dropRandoms = True
         self.configure(name, ip = generateRandomID())
-        self.setRoutingAlgorithm(lambda x: None)
+        self.setRoutingAlgorithm(_noRouting)
 
     def configure(self, name: str = None, 
                   ip: int = -1, 
@@ -68,27 +110,45 @@ class Router:
         self.__packets = packets
     
     def forwardAll(self):
+        net = self.__network
+        table = self.__nextHopVector
+        # a plain lookup in an index table goes destination index -> next hop index -> link, 
+        # without the name to IP to link lookups
+        byIndex = self.__hopWrapper is _lookupHop and type(table) in INDEX_TABLES
+        if table is not self.__linkTable or self.__linkVersion != net.topologyVersion:
+            self.__outLinks = {}
+            self.__linkTable = table
+            self.__linkVersion = net.topologyVersion
+        outLinks = self.__outLinks
         for p in self.__packets:
             self.__process(p)
             if p.getStatus() == DROP: #discard if dropped
                 continue
             if p.getStatus() == RECV: #round trip complete
                 continue
-            nextHopName = self.getNextHopFor(p.dst)
+            if byIndex:
+                hop = table.hopIndex(p.dst)
+                nextHopName = None if hop < 0 else table.names[hop]
+            else:
+                hop = nextHopName = self.getNextHopFor(p.dst)
             self.recordHop(p, nextHopName)
             if p.getStatus() == PROCESSED:
                 p.setStatus(SENT)
-                self.__ackAwaitBuffer.add(p)
+                self.__awaitAck(p)
                 p.log(self, "Packet sent.")
-            if nextHopName == None:
-                if self.getNetwork().tryDNS(nextHopName):
-                    self.updateRoutingTable()
-                nextHopName = self.__nextHopVector[p.dst]
+            nextLink = outLinks.get(hop)
+            if nextLink == None:
                 if nextHopName == None:
-                    self.drop(p)
-                    continue
-            nextHopIP = self.__network.getNodeIP(nextHopName)
-            nextLink = self.__network.getLink((self.getIP(), nextHopIP))
+                    if self.getNetwork().tryDNS(nextHopName):
+                        self.updateRoutingTable()
+                    nextHopName = self.__nextHopVector[p.dst]
+                    if nextHopName == None:
+                        self.drop(p)
+                        continue
+                nextHopIP = self.__network.getNodeIP(nextHopName)
+                nextLink = self.__network.getLink((self.getIP(), nextHopIP))
+                if hop != None:
+                    outLinks[hop] = nextLink
             nextLink.addPacket(p)
         self.__packets = set()
 
@@ -100,71 +160,127 @@ class Router:
 
     def __process_basic(self, packet):
         ## mark and log
-        msg = f"At {self}."
+        msg, args = "At {}.", (self,)
         packet.incrTimeStamp()
         packet.intermedIP = self.getIP()
         if packet.getStatus() == FRESH:
             packet.incrTimeSent()
             # self.__ackAwaitBuffer.add(packet)
-            msg = f"Packet added to {self}"
+            msg = "Packet added to {}"
             packet.setStatus(PROCESSED)
         elif packet.getStatus() == ACK:
             if packet not in self.__ackAwaitBuffer:
                 if self.__dropRandoms:
                     # print("WARNING: A non waited upon ACK'd packet received and discarded!")
-                    msg = f"Dropped random ACK'd packet."
+                    msg, args = "Dropped random ACK'd packet.", ()
                     packet.setStatus(DROP)
                 else:
-                    msg = f"Routing a random ACK'd packet."
+                    msg, args = "Routing a random ACK'd packet.", ()
             else:
-                self.__completed.add(packet)
-                self.__ackAwaitBuffer.remove(packet)
+                self.__retain(self.__completed, packet, None)
+                self.__cancelAck(packet)
                 if packet.dst == self.getName():
                     packet.setStatus(RECV)
-                    msg = f"Round trip completed."         
+                    msg, args = "Round trip completed.", ()
         elif packet.dst == self.getName():
             packet.setStatus(ACK)
-            msg = "Packet received."
+            msg, args = "Packet received.", ()
             packet.dst, packet.src = packet.src, packet.dst
+            packet.acked = True
         else:
-            self.__ackAwaitBuffer.add(packet)
-        packet.log(self, msg)
+            self.__awaitAck(packet)
+        packet.log(self, msg, *args)
+
+    def __awaitAck(self, packet: Packet):
+        self.__ackAwaitBuffer.add(packet)
+        heapq.heappush(self.__ackTimers, (packet.getTimeSent(), self.__ackSeq, packet))
+        self.__ackSeq += 1
+        self.__network.watchAck(self, packet)
+
+    def __cancelAck(self, packet: Packet):
+        self.__ackAwaitBuffer.remove(packet)
+        timers = self.__ackTimers
+        if len(timers) > 2 * len(self.__ackAwaitBuffer) + 64: #mostly cancelled, compact
+            self.__ackTimers = [e for e in timers if e[2] in self.__ackAwaitBuffer]
+            heapq.heapify(self.__ackTimers)
 
     def checkAck(self):
-        droppedPackets = set()
+        """Drops and retransmits timed out packets. 
+        Only pops the timers that expired, so it is cheap when nothing does."""
         t = self.__network.getTime()
         rto = self.__network.RTO
-        for p in self.__ackAwaitBuffer:
-            if t - p.getTimeSent() > rto:
-                droppedPackets.add(p)
-                _, v = p.src, p.dst
-                if p.getStatus() == ACK:
-                    _, v = v, _
-                self.drop(p)
-                self.retransmit(p, p.retransmit)
-        self.__ackAwaitBuffer -= droppedPackets
+        timers = self.__ackTimers
+        while timers and t - timers[0][0] > rto:
+            p = heapq.heappop(timers)[2]
+            if p not in self.__ackAwaitBuffer: #ACK'd, or a duplicate entry
+                continue
+            self.__ackAwaitBuffer.remove(p)
+            self.drop(p)
+            self.retransmit(p, p.retransmit)
+
+    def nextAckTimeout(self):
+        """Tick at which the earliest ACK timer runs out at the current RTO, None if there is none."""
+        if not self.__ackTimers:
+            return None
+        return self.__ackTimers[0][0] + math.floor(self.__network.RTO) + 1
+
+    def getAwaitingAck(self):
+        return self.__ackAwaitBuffer.copy()
+
+    def isAwaitingAck(self):
+        return len(self.__ackAwaitBuffer) > 0
+
+    def countAwaitingAck(self):
+        return len(self.__ackAwaitBuffer)
 
     def drop(self, p: Packet):
         p.setStatus(DROP)
-        p.log(self, f"Packet dropped by {self}.")
+        p.log(self, "Packet dropped by {}.", self)
         p.incrTimeStamp()
+        stats = self.__network.stats
+        if stats != None: stats.dropped += 1
+        self.__network.packetDropped(p)
 
     def setDropRandoms(self, yayOrNay: bool):
         self.__dropRandoms = yayOrNay
 
     def retransmit(self, p, doRetransmit: bool = True):
-        p1 = deepcopy(p)
+        p1 = p.clone()
         p.retransmitNext = p1
         p1.refresh(self)
         if doRetransmit:
+            stats = self.__network.stats
+            if stats != None: stats.retransmitted += 1
             self.addPacket(p1)
         return p1
     
     def recordHop(self, packet: Packet, nextHop: str):
-        self.__recordedHop[packet] = nextHop
+        self.__retain(self.__recordedHop, packet, nextHop, True)
 
     def reportHop(self, packet):
-        return self.__recordedHop[packet]
+        """Next hop last recorded for the packet, None if never recorded or already evicted."""
+        rec = self.__recordedHop.get(packet)
+        return None if rec == None else rec[1]
+
+    def __retain(self, records: OrderedDict, packet: Packet, value, isHop: bool = False):
+        """Records the packet as most recent, then evicts the oldest records 
+        past the network's retention window or cap, spilling hops to the trace sink if asked."""
+        t = self.__network.getTime()
+        window, cap, spill = self.__network.getRetention()
+        records[packet] = (t, value)
+        if window == None and cap == None: #nothing is ever evicted, so the order doesn't matter
+            return
+        records.move_to_end(packet)
+        if window == None and len(records) <= cap:
+            return
+        sink = self.__network.getTraceSink() if spill and isHop else None
+        while records:
+            tRec, hop = next(iter(records.values()))
+            if (cap == None or len(records) <= cap) and (window == None or t - tRec <= window):
+                break
+            p, _ = records.popitem(last=False)
+            if sink != None and sink.wants(p):
+                sink.recordHop(p, self, hop, tRec)
 
     def __process(self, packet: Packet):
         ##malicious will be able to modify this
@@ -176,11 +292,18 @@ class Router:
         ##run routing algorithm
         ##for every node, determine next hop
         self.__nextHopVector = self.__routing(self.__network, self)
+
+    def setRoutingTable(self, nextHopVector):
+        """Installs a table computed elsewhere, e.g. by the network in a batch."""
+        self.__nextHopVector = nextHopVector
     
     def setRoutingAlgorithm(self, algorihtm):
         self.__auxiliary = None
-        self.__hopWrapper = lambda vector, name: vector[name]
+        self.__hopWrapper = _lookupHop
         self.__routing = algorihtm
+
+    def getRoutingAlgorithm(self):
+        return self.__routing
     
     def setAuxiliary(self, func, *args):
         if self.__auxiliary == None:
@@ -212,6 +335,14 @@ class Router:
     def setNetwork(self, network: Network):
         self.configure(name=self.__name, ip=self.__ip, network=network, packets=self.__packets)
     #endregion
+    #region router Index
+    def getIndex(self):
+        """Index handed out by the network when the router was added, -1 before."""
+        return self.__index
+
+    def setIndex(self, index: int):
+        self.__index = index
+    #endregion
     #region router Links
     def getLinks(self):
         return [self.getNetwork().getLink(id) for id in self.__links]
@@ -237,6 +368,14 @@ class Router:
 
     def addPackets(self, packets: list[Packet]):
         self.__packets = self.__packets.union(set(packets))
+        if self.__network != None:
+            self.__network.wakeNode(self)
+
+    def hasPackets(self):
+        return len(self.__packets) > 0
+
+    def countPackets(self):
+        return len(self.__packets)
 
     def addPacket(self, packet):
         self.addPackets([packet])
@@ -265,6 +404,14 @@ class Router:
 
     def __repr__(self):
         return f"Router({self.__name})"
+
+    def __getstate__(self):
+        #cached links lead on to other routers, pickling would recurse through the whole graph
+        state = self.__dict__.copy()
+        state['_Router__outLinks'] = {}
+        state['_Router__linkTable'] = None
+        state['_Router__linkVersion'] = -1
+        return state
     
     def __lt__(self, other):
         if not isinstance(other, Router):
@@ -291,12 +438,25 @@ class Link:
     def __init__(self, u: int, v: int, 
         weight: float = 1, 
         network: Network = None):
-        self.weight = weight
+        self.__network = network
         self.u = u
         self.v = v
         self.id = generateRandomID()
+        self.__index = -1
         self.__packets = set()
-        self.__network = network
+        self.__ends = None
+        self.__endsVersion = -1
+        self.weight = weight #last, the setter tells the network
+
+    @property
+    def weight(self):
+        return self.__weight
+
+    @weight.setter
+    def weight(self, w):
+        self.__weight = w
+        if self.__network != None:
+            self.__network.linkChanged(self)
 
     def addPacket(self, packet: Packet):
         if self.__network == None:
@@ -305,9 +465,20 @@ class Link:
             raise CustomError("Packet already on Link!")
         packet.incrTimeStamp()
         self.__packets.add(packet)
+        self.__network.wakeLink(self, packet)
+
+    def getPackets(self):
+        return self.__packets.copy()
+
+    def hasPackets(self):
+        return len(self.__packets) > 0
     
     def getEndpoints(self) -> tuple[Router, Router]:
-        return (self.__network.getNodeFromIP(self.u), self.__network.getNodeFromIP(self.v))
+        net = self.__network
+        if self.__endsVersion != net.topologyVersion:
+            self.__ends = (net.getNodeFromIP(self.u), net.getNodeFromIP(self.v))
+            self.__endsVersion = net.topologyVersion
+        return self.__ends
     
     def hasEndpoint(self, ip: int) -> bool:
         return ip == self.u or ip == self.v
@@ -317,60 +488,385 @@ class Link:
         discarded = set()
         for p in self.__packets:
             if p.getStatus() == DROP:
-                p.log(self, f"Packet dropped by source, stopped logging at {self}")
+                p.log(self, "Packet dropped by source, stopped logging at {}", self)
                 discarded.add(p)
                 continue
-            p.log(self, f"At link {self}")
-            u, v = self.getEndpoints()
+            p.log(self, "At link {}", self)
             if self.__network.getTime() - p.getTimeStamp() > self.weight:
                 # print("PACKET", self.__network.getTime(), p.getTimeStamp(), self.weight)
                 discarded.add(p)
-                if p.intermedIP == self.u:
-                    v.addPacket(p)
-                else:
-                    u.addPacket(p)
+                self.__handOver(p)
         self.__packets -= discarded
 
+    def deliverPacket(self, p: Packet) -> bool:
+        """Delivers a single packet if its arrival time has come, or discards it if it was 
+        dropped, as deliverPackets would (EVENT engine). Unlike deliverPackets, the link 
+        is only logged once, on arrival. Returns False if the packet stays on the link, 
+        its arrival having been pushed back by a weight change."""
+        if p not in self.__packets:
+            return True
+        if p.getStatus() == DROP:
+            self.__packets.remove(p)
+            p.log(self, "Packet dropped by source, stopped logging at {}", self)
+            return True
+        t = self.arrivalTime(p)
+        if t == None or t > self.__network.getTime():
+            return False
+        self.__packets.remove(p)
+        p.log(self, "At link {}", self)
+        self.__handOver(p)
+        return True
+
+    def arrivalTime(self, p: Packet):
+        """First tick at which deliverPackets would hand the packet over, None if never."""
+        if math.isinf(self.weight):
+            return None
+        return p.getTimeStamp() + math.floor(self.weight) + 1
+
+    def __handOver(self, p: Packet):
+        stats = self.__network.stats
+        if stats != None: stats.hopsDelivered += 1
+        u, v = self.getEndpoints()
+        if p.intermedIP == self.u:
+            v.addPacket(p)
+        else:
+            u.addPacket(p)
+
     def setNetwork(self, network: Network):
         self.__network = network
 
     def getNetwork(self):
         return self.__network
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_Link__ends'] = None
+        state['_Link__endsVersion'] = -1
+        return state
+
+    def getIndex(self):
+        """Index handed out by the network when the link was added, -1 before."""
+        return self.__index
+
+    def setIndex(self, index: int):
+        self.__index = index
+
     def __repr__(self):
+        if not (self.__network.hasNodeIP(self.u) and self.__network.hasNodeIP(self.v)):
+            return f"Link({self.u} <-> {self.v})" #an endpoint was removed since
         u, v = self.getEndpoints()
         return f"Link({u.getName()} <-> {v.getName()})"
 
+# Counters and timings collected by a network while stats are enabled
+class NetworkStats:
+    PHASES = ('deliver', 'checkAck', 'forward', 'routing')
+
+    def __init__(self, sampleEvery: int = 1, callback = None, callbackEvery: int = 100):
+        self.sampleEvery = sampleEvery
+        self.callback = callback
+        self.callbackEvery = callbackEvery
+        self.phaseTime = {phase: 0.0 for phase in NetworkStats.PHASES}
+        self.ticks = 0
+        self.hopsDelivered = 0      # packets handed over by a link to a router, once per hop
+        self.dropped = 0
+        self.retransmitted = 0
+        self.routeRecomputes = 0    # triggerNodesExplore calls
+        self.tablesRecomputed = 0   # routing tables rebuilt by them
+        self.routeCacheHits = 0     # routes loaded from the route cache instead
+        # per router that ran since the sample before (most packets queued at once, packets 
+        # awaiting an ACK) at the last sample, and the peaks over all samples. Routers that did 
+        # not run are left out: only running adds packets to their queue or ACK buffer
+        self.lastSample = {}
+        self.queued = {}
+        self.maxQueue = 0
+        self.maxAwaitingAck = 0
+        self.__nextSample = None
+        self.__nextCallback = None
+
+    def endTick(self, network: Network):
+        """Called by the network after each tick it ran."""
+        self.ticks += 1
+        t = network.getTime()
+        if self.__nextSample == None or t >= self.__nextSample:
+            self.__nextSample = t + self.sampleEvery
+            self.lastSample = {n.getName(): (q, n.countAwaitingAck()) for n, q in self.queued.items()}
+            self.queued = {}
+            for queued, awaiting in self.lastSample.values():
+                self.maxQueue = max(self.maxQueue, queued)
+                self.maxAwaitingAck = max(self.maxAwaitingAck, awaiting)
+        if self.callback != None:
+            if self.__nextCallback == None:
+                self.__nextCallback = t + self.callbackEvery
+            elif t >= self.__nextCallback:
+                self.__nextCallback = t + self.callbackEvery
+                self.callback(network, self)
+
+    def asDict(self) -> dict:
+        return {'ticks': self.ticks, 'phaseTime': self.phaseTime.copy(), 
+                'hopsDelivered': self.hopsDelivered, 'dropped': self.dropped, 
+                'retransmitted': self.retransmitted, 'routeRecomputes': self.routeRecomputes, 
+                'tablesRecomputed': self.tablesRecomputed, 'routeCacheHits': self.routeCacheHits, 
+                'maxQueue': self.maxQueue, 'maxAwaitingAck': self.maxAwaitingAck, 
+                'lastSample': self.lastSample.copy()}
+
 # Network topology
 class Network:
-    def __init__(self, RTO: int = 20):
+    def __init__(self, RTO: int = 20, engine: Engine = TICK, seed: int = None):
         self.__time = 0
+        self.rng = random.Random(seed) #all random choices made inside the simulation
+        self.stats = None #NetworkStats while enabled
         self.__dns = {}
         self.__links = {}
         self.__nodes = {}
         self.RTO = RTO
         self.numNodes = 0
+        self.topologyVersion = 0 #bumped whenever routers or links are added or removed, for the caches keyed on it
         self.routingDefault = DijkstraNextHop
+        self.randomHops = None #ProbabilisticDijkstra's candidate hops, see ProbabilisticFromPaths
         self.dropRandoms = True
-    
-    def updateTick(self):
+        self.__events = []
+        self.__eventSeq = 0
+        self.__onLink = {} #packet -> the link it is on, for the EVENT engine
+        self.__traffic = [] #(release time, seq, Packet or traffic batch)
+        self.__trafficSeq = 0
+        self.__activeNodes = {}
+        self.__activeLinks = {}
+        self.__adjacency = None
+        self.__routers = (-1, None)
+        self.__routeStore = (None, False, None)
+        self.__routeCache = None
+        self.__routes = None
+        self.__installed = set() #routers whose tables are views on __routes
+        self.__changedLinks = set()
+        self.__editDepth = 0
+        self.__editPending = False
+        self.__nodeNames = []
+        self.__linkEnds = []
+        self.__freeNodeIndices = [] #indices of removed routers and links, handed out again
+        self.__freeLinkIndices = []
+        self.__trace = None
+        self.__retention = (None, 1 << 16, False)
+        self.setEngine(engine)
+
+    #region engine
+    def getEngine(self) -> Engine:
+        return self.__engine
+
+    def setEngine(self, engine: Engine):
+        """
+        TICK walks every link and router once per tick.
+        ACTIVE also steps one tick at a time, but only walks the links holding 
+        packets and the routers with queued packets or pending ACKs.
+        EVENT keeps a queue of packet arrivals and RTO expiries and jumps 
+        the clock straight to the next tick that has work. Links are then 
+        logged once per hop instead of once per tick. Arrivals are moved when 
+        a link's weight changes, and dropped packets are taken off their link 
+        on the next tick, as the other engines do.
+        """
+        self.__engine = engine
+        self.__events = []
+        self.__onLink = {}
+        self.__activeNodes = {}
+        self.__activeLinks = {}
+        if engine == TICK:
+            return
+        #resync with whatever is in flight
+        for l in set(self.__links.values()):
+            for p in l.getPackets():
+                self.wakeLink(l, p)
+        for n in self.__nodes.values():
+            if n.hasPackets():
+                self.wakeNode(n)
+            for p in n.getAwaitingAck():
+                self.watchAck(n, p)
+
+    def wakeNode(self, router: Router):
+        """Called by routers when they are handed packets."""
+        if self.__engine != TICK:
+            self.__activeNodes[router] = None
+
+    def wakeLink(self, link: Link, packet: Packet):
+        """Called by links when a packet is put on them."""
+        if self.__engine == ACTIVE:
+            self.__activeLinks[link] = None
+        elif self.__engine == EVENT:
+            self.__onLink[packet] = link
+            self.__scheduleArrival(link, packet)
+
+    def __scheduleArrival(self, link: Link, packet: Packet):
+        #at the next tick if the link's current weight says the packet is already due
+        t = link.arrivalTime(packet)
+        if t != None:
+            self.__pushEvent(max(t, self.__time + 1), ARRIVE, link, packet)
+
+    def packetDropped(self, packet: Packet):
+        """Called by routers when they drop a packet, which may be on a link."""
+        if self.__engine == EVENT:
+            link = self.__onLink.get(packet)
+            if link != None:
+                self.__pushEvent(self.__time + 1, ARRIVE, link, packet)
+
+    def watchAck(self, router: Router, packet: Packet):
+        """Called by routers when they start waiting on an ACK."""
+        if self.__engine == ACTIVE:
+            self.__activeNodes[router] = None
+        elif self.__engine == EVENT:
+            t = packet.getTimeSent() + math.floor(self.RTO) + 1
+            self.__pushEvent(max(t, self.__time + 1), TIMEOUT, router, packet)
+
+    def __pushEvent(self, t: int, kind: int, obj, packet: Packet):
+        heapq.heappush(self.__events, (t, self.__eventSeq, kind, obj, packet))
+        self.__eventSeq += 1
+
+    def __nextEventTime(self):
+        t = None
+        if self.__events:
+            t = max(self.__events[0][0], self.__time + 1)
+        if self.__traffic:
+            tSend = max(self.__traffic[0][0], self.__time + 1)
+            t = tSend if t == None else min(t, tSend)
+        if self.__activeNodes:
+            t = self.__time + 1
+        return t
+
+    def __tick(self):
         ###increment time
         self.incrementTime()
+        if self.__traffic: self.__releaseTraffic()
         ###peform all deliveries to routers
         links = set(self.__links.values())
         nodes = set(self.__nodes.values())
+        stats = self.stats
+        if stats != None: t0 = perf_counter()
         for l in links:
             l.deliverPackets()
+        if stats != None: stats.phaseTime['deliver'] += perf_counter() - t0
         for n in nodes:
             ###peform ack TTL checks
             ###make routers forward packets (based on time)
             ###check if any packet is destined to you
+            if stats == None:
+                n.checkAck()
+                n.forwardAll()
+            else:
+                self.__timedRouter(stats, n, True)
+
+    def __activeTick(self):
+        self.incrementTime()
+        if self.__traffic: self.__releaseTraffic()
+        links = self.__activeLinks
+        self.__activeLinks = {}
+        stats = self.stats
+        if stats != None: t0 = perf_counter()
+        for l in links:
+            if self.__links.get(l.id) is not l:
+                continue
+            l.deliverPackets()
+            if l.hasPackets():
+                self.__activeLinks[l] = None
+        if stats != None: stats.phaseTime['deliver'] += perf_counter() - t0
+        ###routers handed packets above are already in the active set
+        nodes = self.__activeNodes
+        self.__activeNodes = {}
+        for n in nodes:
+            if self.__nodes.get(n.getIP()) is not n:
+                continue
+            if stats == None:
+                n.checkAck()
+                n.forwardAll()
+            else:
+                self.__timedRouter(stats, n, True)
+        for n in nodes:
+            if n.hasPackets() or n.isAwaitingAck():
+                self.__activeNodes[n] = None
+
+    def __eventTick(self):
+        t = self.__time
+        if self.__traffic: self.__releaseTraffic()
+        timeouts = {}
+        stats = self.stats
+        if stats != None: t0 = perf_counter()
+        ###peform the deliveries due now
+        while self.__events and self.__events[0][0] <= t:
+            _, _, kind, obj, p = heapq.heappop(self.__events)
+            if kind == ARRIVE:
+                if self.__links.get(obj.id) is obj and not obj.deliverPacket(p):
+                    continue #due later, the event for the new arrival time is queued
+                if self.__onLink.get(p) is obj:
+                    del self.__onLink[p]
+            else:
+                timeouts[obj] = None
+        if stats != None: stats.phaseTime['deliver'] += perf_counter() - t0
+        ###same per router order as __tick: ack checks, then forwarding
+        active = self.__activeNodes
+        self.__activeNodes = {}
+        for n in list(timeouts) + [n for n in active if n not in timeouts]:
+            if self.__nodes.get(n.getIP()) is not n:
+                continue
+            if stats != None:
+                self.__timedRouter(stats, n, n in timeouts)
+            else:
+                if n in timeouts:
+                    n.checkAck()
+                n.forwardAll()
+            if n in timeouts:
+                nxt = n.nextAckTimeout() #in case the RTO was raised since the timer was set
+                if nxt != None and nxt > t:
+                    self.__pushEvent(nxt, TIMEOUT, n, None)
+        #routers woken while being processed have already forwarded
+        self.__activeNodes = {n: None for n in self.__activeNodes if n.hasPackets()}
+
+    def __timedRouter(self, stats: NetworkStats, n: Router, checkAck: bool):
+        q = n.countPackets()
+        if q >= stats.queued.get(n, 0): #0 too, every router that ran is sampled
+            stats.queued[n] = q
+        t0 = perf_counter()
+        if checkAck:
             n.checkAck()
-            n.forwardAll()
+        t1 = perf_counter()
+        n.forwardAll()
+        stats.phaseTime['checkAck'] += t1 - t0
+        stats.phaseTime['forward'] += perf_counter() - t1
+
+    def runUntil(self, time: int):
+        """Advances the simulation until the clock reads the given time."""
+        if self.__engine == EVENT:
+            t = self.__nextEventTime()
+            while t != None and t <= time:
+                self.__time = t
+                self.__eventTick()
+                if self.stats != None: self.stats.endTick(self)
+                t = self.__nextEventTime()
+            self.__time = max(self.__time, time)
+            return
+        tick = self.__activeTick if self.__engine == ACTIVE else self.__tick
+        while self.__time < time:
+            tick()
+            if self.stats != None: self.stats.endTick(self)
+
+    def enableStats(self, sampleEvery: int = 1, callback = None, callbackEvery: int = 100):
+        """
+        Starts collecting per phase timings, packet and routing counters, and 
+        samples of router queue and ACK buffer sizes every sampleEvery ticks, 
+        of the routers that ran since the sample before. 
+        callback(network, stats) is called every callbackEvery ticks.
+        """
+        self.stats = NetworkStats(sampleEvery, callback, callbackEvery)
+
+    def disableStats(self):
+        self.stats = None
+
+    def getStats(self) -> dict:
+        if self.stats == None:
+            raise CustomError("Stats are not enabled!")
+        return self.stats.asDict()
+    #endregion
+    
+    def updateTick(self):
+        self.runUntil(self.__time + 1)
             
     def updateTickN(self, n: int):
-        for _ in range(n):
-            self.updateTick()
+        self.runUntil(self.__time + n)
 
     def updateTickTill(self, packet: Packet, 
                        status: Status, 
@@ -438,7 +934,7 @@ class Network:
         ###     1 0 0      c
         adjacency_list = defaultdict(list, adjacency_list)
         links = []
-        routers = set()
+        routers = {} #first seen order, so that the routers are in the same order on every run
         namesUsed = {}
         for n in node_names:
             if n in namesUsed:
@@ -453,9 +949,74 @@ class Network:
                     r2 = Router(v)
                     namesUsed[v] = r2
                 links.append(Link(r1.getIP(), r2.getIP(), w, self))
-                routers.add(r1)
-                routers.add(r2)
-        self.changeTopology_l(links, routers)
+                routers[r1] = None
+                routers[r2] = None
+        self.changeTopology_l(links, list(routers))
+
+    def changeTopology_ea(self, names: list[str], src, dst, weights, explore: bool = True):
+        """
+        Replaces the topology in one batch from edge arrays: link k joins routers 
+        names[src[k]] and names[dst[k]]. Routers get indices in the order of names. 
+        Self loops are skipped and, as with addLink, a later link between the 
+        same pair replaces an earlier one. Routes are only computed if explore.
+        """
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        weights = np.asarray(weights)
+        ###one link per unordered pair, the last one given
+        keep = src != dst
+        src, dst, weights = src[keep], dst[keep], weights[keep]
+        pair = np.minimum(src, dst) * len(names) + np.maximum(src, dst)
+        _, last = np.unique(pair[::-1], return_index=True)
+        order = np.sort(len(pair) - 1 - last)
+        src, dst, weights = src[order], dst[order], weights[order]
+
+        for n in self.__nodes.values():
+            n.destroy()
+        self.__resetIndices()
+        self.__nodes.clear()
+        self.__links.clear()
+        self.__dns.clear()
+        self.numNodes = 0
+        #nothing built here is garbage, so spare the collector walking millions of new objects
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.__buildFromArrays(names, src, dst, weights)
+        finally:
+            if gcWasEnabled: gc.enable()
+        if explore:
+            self.triggerNodesExplore()
+
+    def __buildFromArrays(self, names: list[str], src, dst, weights):
+        self.topologyVersion += 1
+        routers = [Router(name) for name in names]
+        for r in routers:
+            self.addNode(r, True)
+        ###what addLink does, minus the lookups and checks the batch makes unnecessary
+        ips = [r.getIP() for r in routers]
+        indices = [r.getIndex() for r in routers]
+        links, ends = self.__links, self.__linkEnds
+        for u, v, w in zip(src.tolist(), dst.tolist(), weights.tolist()):
+            link = Link(ips[u], ips[v], w, self)
+            link.setIndex(len(ends))
+            ends.append((indices[u], indices[v]))
+            links[(link.u, link.v)] = link
+            links[(link.v, link.u)] = link
+            links[link.id] = link
+            routers[u].addLink(link.id)
+            routers[v].addLink(link.id)
+
+    def changeTopology_csr(self, indptr, indices, weights, names: list[str] = None, explore: bool = True):
+        """
+        changeTopology_ea from a CSR adjacency, e.g. (m.indptr, m.indices, m.data) of a 
+        scipy.sparse matrix. Routers are named node0, node1, ... unless names are given.
+        """
+        indptr = np.asarray(indptr)
+        n = len(indptr) - 1
+        names = ["node" + str(i) for i in range(n)] if names == None else names
+        src = np.repeat(np.arange(n), np.diff(indptr))
+        self.changeTopology_ea(names, src, indices, weights, explore)
 
     def refreshDns(self):
         for e in self.__links.values():
@@ -464,17 +1025,133 @@ class Network:
             self.__dns[v.getName()] = v.getIP()
 
     def triggerNodesExplore(self):
+        """
+        Updates every router's routing table. Dijkstra routed routers are filled 
+        from a RoutingState shared by the whole network, which after link 
+        changes only recomputes the routers those changes can affect, or from 
+        a LazyRoutes that computes them on first lookup, see setRouteStore. 
+        Adding or removing routers starts it over.
+        """
+        stats = self.stats
+        if stats != None: t0 = perf_counter()
         nodes = set(self.__nodes.values())
+        batched = {n for n in nodes if self.__isBatchRouted(n)}
+        if self.__routes == None:
+            if batched:
+                path, compressed, lazyBudget = self.__routeStore
+                if lazyBudget != None:
+                    self.__routes = LazyRoutes(self, lazyBudget)
+                else:
+                    self.__routes = RoutingState(self, path, compressed, self.__routeCache)
+                    if stats != None and self.__routes.cached:
+                        stats.routeCacheHits += 1
+            stale = set(batched)
+        else:
+            if self.__routes.shared and self.__changedLinks:
+                self.__routes.unshare()
+                self.__installed = set()
+            stale = set(self.__routes.update(self, self.__changedLinks))
+            stale.update(n for n in batched if n not in self.__installed)
+        self.__changedLinks = set()
+        rebuilt = 0
         for n in nodes:
             r: Router = n
-            r.updateRoutingTable()
+            if r in stale and r in batched:
+                makeTable = BATCH_ROUTING[r.getRoutingAlgorithm()]
+                r.setRoutingTable(makeTable(self, r, *self.__routes.tableFor(r)))
+                rebuilt += 1
+            elif r not in batched:
+                r.updateRoutingTable()
+                rebuilt += 1
+        if self.__routes != None:
+            self.__installed = batched
+        if stats != None:
+            stats.routeRecomputes += 1
+            stats.tablesRecomputed += rebuilt
+            stats.phaseTime['routing'] += perf_counter() - t0
+
+    def linkChanged(self, link: Link):
+        """Called when a link is added or reweighted, so routes can be patched 
+        and, on the EVENT engine, the packets on it arrive when the new weight says."""
+        if self.__engine == EVENT:
+            for p in link.getPackets():
+                self.__scheduleArrival(link, p)
+        if self.__routes != None:
+            self.__changedLinks.add((link.u, link.v))
+        adj = self.__adjacency
+        if adj != None and adj.version == self.topologyVersion and self.__links.get(link.id) is link:
+            adj.setWeight(link)
+
+    def __routerList(self) -> list[Router]:
+        #the routers in adjacency order, kept apart from it since link changes don't touch them
+        if self.__routers[0] != self.topologyVersion:
+            self.__routers = (self.topologyVersion, list(self.__nodes.values()))
+        return self.__routers[1]
+
+    def setRouteStore(self, path: str = None, compressed: bool = False, lazyBudget: int = None):
+        """
+        Where the batched routes are kept from the next triggerNodesExplore on: in memory 
+        (path None) or in memory mapped files under path. If compressed the next hops are 
+        run-length encoded, and distances and parents are memory mapped even without path, 
+        from temporary files. See RoutingState.
+        With lazyBudget they are instead computed per router on its first lookup, and at 
+        most lazyBudget bytes of them are kept. See LazyRoutes.
+        """
+        self.__routeStore = (path, compressed, lazyBudget)
+        self.__invalidateRoutes()
+
+    def getRouteStore(self):
+        return self.__routeStore
+
+    def setRouteCache(self, path: str = None):
+        """
+        Directory where the batched routes of every topology are saved, to be loaded 
+        instead of computed when a network with the same routers and link weights 
+        explores again, e.g. another trial on the same topology. None turns it off. 
+        Lazy routes are never cached. See RoutingState.
+        """
+        self.__routeCache = path
+
+    def getRouteCache(self) -> str:
+        return self.__routeCache
+
+    def getAdjacency(self) -> Adjacency:
+        """CSR arrays of the topology, rebuilt on first use after routers or links were added or removed."""
+        adj = self.__adjacency
+        if adj == None or adj.version != self.topologyVersion:
+            adj = self.__adjacency = Adjacency(self)
+        return adj
+
+    def __invalidateRoutes(self):
+        self.__routes = None
+        self.__changedLinks = set()
+
+    def beginTopologyEdit(self):
+        """Defers the route updates of setLink until the matching commitTopologyEdit."""
+        self.__editDepth += 1
+
+    def commitTopologyEdit(self):
+        if self.__editDepth == 0:
+            raise CustomError("No topology edit to commit!")
+        self.__editDepth -= 1
+        if self.__editDepth == 0 and self.__editPending:
+            self.__editPending = False
+            self.triggerNodesExplore()
+
+    def __isBatchRouted(self, router: Router) -> bool:
+        #routers that override updateRoutingTable keep doing their own thing
+        return (router.getRoutingAlgorithm() in BATCH_ROUTING
+                and type(router).updateRoutingTable is Router.updateRoutingTable)
 
     def __setLinkMap(self, links: list[Link]):
+        self.topologyVersion += 1
         self.__links.clear()
         for e in links:
             self.addLink(e)
 
     def __setNodeMap(self, nodes: list[Router]):
+        self.topologyVersion += 1
+        self.__resetIndices()
         self.__nodes.clear()
         for n in nodes:
             self.addNode(n)
@@ -487,7 +1164,10 @@ class Network:
                 print("WARNING: name already exists!")
                 return
         self.numNodes += 1
+        self.topologyVersion += 1
+        self.__invalidateRoutes()
         router.setDropRandoms(self.dropRandoms)
+        router.setIndex(Network.__takeIndex(self.__nodeNames, self.__freeNodeIndices, router.getName()))
         router.setNetwork(self)
         router.setRoutingAlgorithm(self.routingDefault)
         self.__nodes[router.getIP()] = router
@@ -498,16 +1178,21 @@ class Network:
         ip = router.getIP()
         name = router.getName()
         self.numNodes -= 1
+        self.topologyVersion += 1
+        self.__invalidateRoutes()
         linksRemove = []
         for link in router.getLinks():
             u, v = link.getEndpoints()
             u.removeLink(link.id)
             v.removeLink(link.id)
             linksRemove.extend([link.id, (link.u, link.v), (link.v, link.u)])
+            self.__freeLinkIndex(link)
 
 
         for key in linksRemove:
             del self.__links[key]
+        self.__freeNodeIndices.append(router.getIndex())
+        router.setIndex(-1)
 
         if ip in self.__nodes:
             del self.__nodes[ip]
@@ -523,11 +1208,15 @@ class Network:
         if not ignoreExisting and link.id in self.__links:
             raise CustomError("Link already exists")
         link.setNetwork(self)
+        self.topologyVersion += 1
         u, v = link.getEndpoints()
         ip1, ip2 = link.u, link.v
         prevID = -1
+        if link.getIndex() < 0:
+            link.setIndex(Network.__takeIndex(self.__linkEnds, self.__freeLinkIndices, (u.getIndex(), v.getIndex())))
         if (ip1, ip2) in self.__links:
-            prevID = self.__links[(ip1, ip2)].id
+            prev = self.__links[(ip1, ip2)]
+            prevID = prev.id
         self.__links[(ip1, ip2)] = link
         self.__links[(ip2, ip1)] = link
         self.__links[link.id] = link
@@ -537,10 +1226,40 @@ class Network:
             u.removeLink(prevID)
             v.removeLink(prevID)
             del self.__links[prevID]
+            self.__freeLinkIndex(prev)
+        self.linkChanged(link)
+
+    @staticmethod
+    def __takeIndex(entries: list, free: list, entry) -> int:
+        #a freed index if there is one, so that routers and links coming and going, 
+        #e.g. probers, don't grow the lists for good
+        if free:
+            i = free.pop()
+            entries[i] = entry
+            return i
+        entries.append(entry)
+        return len(entries) - 1
+
+    def __freeLinkIndex(self, link: Link):
+        if link.getIndex() >= 0:
+            self.__freeLinkIndices.append(link.getIndex())
+            link.setIndex(-1)
+
+    def __resetIndices(self):
+        #the whole topology is replaced, its routers and links are indexed again from 0
+        for l in set(self.__links.values()):
+            l.setIndex(-1)
+        self.__nodeNames = []
+        self.__linkEnds = []
+        self.__freeNodeIndices = []
+        self.__freeLinkIndices = []
 
     def setLink(self, link: Link):
         self.addLink(link)
-        self.triggerNodesExplore()
+        if self.__editDepth:
+            self.__editPending = True
+        else:
+            self.triggerNodesExplore()
         
     def changeDNSEntry(self, oldname: str, newname: str) -> bool:
         if newname in self.__dns:
@@ -561,8 +1280,35 @@ class Network:
     def incrementTime(self):
         self.__time += 1
 
-    def scheduleSend(self, name: str):
-        ... #maybe
+    def scheduleSend(self, packet: Packet, time: int):
+        """Sends the packet so that its source processes it at the given tick, 
+        as send would have right before that tick (the next tick if it has passed)."""
+        heapq.heappush(self.__traffic, (time, self.__trafficSeq, packet))
+        self.__trafficSeq += 1
+
+    def scheduleTraffic(self, batch):
+        """
+        Queues a batch of future sends, e.g. from Traffic.py. The batch only needs
+        nextTime(), the release time of its next send (None once empty), and 
+        release(network, time), which sends everything due by then.
+        """
+        t = batch.nextTime()
+        if t != None:
+            heapq.heappush(self.__traffic, (t, self.__trafficSeq, batch))
+            self.__trafficSeq += 1
+
+    def hasPendingTraffic(self) -> bool:
+        return len(self.__traffic) > 0
+
+    def __releaseTraffic(self):
+        t = self.__time
+        while self.__traffic and self.__traffic[0][0] <= t:
+            _, _, item = heapq.heappop(self.__traffic)
+            if type(item) == Packet:
+                self.send(item)
+                continue
+            item.release(self, t)
+            self.scheduleTraffic(item)
     
     def send(self, packet: Packet):
         srcNode = self.getNode(packet.src)
@@ -570,6 +1316,8 @@ class Network:
             raise CustomError("Src for packet wasn't found!")
         packet.setNetwork(self)
         packet.setStatus(FRESH)
+        if self.__trace != None and self.__trace.wants(packet):
+            packet.setTrace(self.__trace)
         srcNode.addPacket(packet)
         
     
@@ -589,10 +1337,10 @@ class Network:
                       failureCond: int = 100, 
                       invalid: set = None):
         invalid = set() if invalid == None else invalid
-        keys = list(self.__nodes.keys())
+        nodes = self.__routerList()
         while (failureCond):
-            randInd = random.randint(0, len(keys) - 1)
-            res = self.__nodes[keys[randInd]]
+            randInd = self.rng.randint(0, len(nodes) - 1)
+            res = nodes[randInd]
             isInvalid = res in invalid
             isBadType = type(res) == Attacker or type(res) == Defender
             if not isInvalid and (targetAll or not isBadType): return res
@@ -602,6 +1350,37 @@ class Network:
 
     def getNodeFromIP(self, ip) -> Router:
         return self.__nodes[ip]
+
+    def hasNodeIP(self, ip) -> bool:
+        return ip in self.__nodes
+
+    def getNodeNames(self) -> list[str]:
+        """Router names by index. A removed router's name stays until its index is given 
+        to another router or the topology is replaced."""
+        return self.__nodeNames.copy()
+
+    def getLinkEnds(self, index: int = None):
+        """Router indices of the ends of the link that was given this index (all links if None), 
+        kept after it is removed as router names are."""
+        return self.__linkEnds.copy() if index == None else self.__linkEnds[index]
+
+    def setTraceSink(self, sink):
+        """Packets sent from now on that the sink wants are also traced to it."""
+        self.__trace = sink
+        if sink != None:
+            sink.attach(self)
+
+    def getTraceSink(self):
+        return self.__trace
+
+    def setRetention(self, window: int = None, cap: int = 1 << 16, spill: bool = False):
+        """How long routers keep the hops they recorded and the packets they completed: 
+        at most cap packets each, none older than window ticks (None for no limit). 
+        With spill, evicted hops of traced packets go to the trace sink."""
+        self.__retention = (window, cap, spill)
+
+    def getRetention(self):
+        return self.__retention
         
     
     def setNode(self, node: Router):
@@ -628,17 +1407,89 @@ class Network:
             raise CustomError("Name to IP mapping doesn't exit")
         return node.getIP()
 
+    #region snapshots
+    def __getstate__(self):
+        #the trace sink holds a file and stats callbacks are often lambdas, neither is carried over
+        state = self.__dict__.copy()
+        state['_Network__trace'] = None
+        state['_Network__adjacency'] = None
+        state['_Network__routers'] = (-1, None)
+        state['stats'] = None
+        return state
+
+    def save(self, path: str):
+        """
+        Writes the whole simulation to a binary file: topology, routing tables, 
+        packets queued, on links or awaiting ACKs, pending traffic, the clock and the RNG.
+        Routing functions and hop wrappers have to be module level to be saved.
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> Network:
+        with open(path, 'rb') as f:
+            net = pickle.load(f)
+        if type(net) != Network:
+            raise CustomError("Not a saved network!")
+        return net
+
+    def inFlight(self) -> set[Packet]:
+        """Packets the simulation can still change: queued, on links, awaiting ACKs or scheduled."""
+        packets = set()
+        for n in self.__nodes.values():
+            packets.update(n.getPackets())
+            packets.update(n.getAwaitingAck())
+        for l in self.__links.values():
+            packets.update(l.getPackets())
+        packets.update(e[-1] for e in self.__events if type(e[-1]) == Packet)
+        packets.update(item for _, _, item in self.__traffic if type(item) == Packet)
+        return packets
+
+    def fork(self) -> Network:
+        """
+        An independent copy of the simulation to run what-if probes on. Only what the 
+        copy can change is copied: the route arrays are shared until either side 
+        recomputes them, and packets that are done, e.g. the ones routers recorded hops for, 
+        are the same objects in both, so they can be used to query either network.
+        The copy has no trace sink and no stats.
+        """
+        routes = self.__routes
+        shared = {} if routes == None else {id(a): a for a in routes.sharedArrays()}
+        inFlight = self.inFlight()
+        buf = io.BytesIO()
+        _ForkPickler(buf, shared, inFlight).dump(self)
+        _FORK_SHARED.update(shared)
+        try:
+            child = pickle.loads(buf.getbuffer())
+        finally:
+            _FORK_SHARED.clear()
+        if routes != None:
+            routes.shared = True
+            child.__routes.shared = True
+        return child
+    #endregion
+
 # Packet object
 class Packet:
+    __slots__ = ('src', 'dst', 'acked', 'intermedIP', 'retransmitNext', 'retransmit', 'rtCount', 
+                 'packetID', 'status', '__log', '__first', '__visited', '__last', 
+                 '__timeSent', '__timeStamp', '__network', '__trace')
+
     def __init__(self, src: str, dst: str, logBit: bool = False, 
                  status: Status = None, network: Network = None, 
                  retransmit = True):
         self.src = src
         self.dst = dst
+        self.acked = False #src and dst swapped by the destination for the way back
         self.intermedIP = -1
-        self.__logBit = logBit
-        self.__log = []
-        self.__summary = [None, [], None]
+        self.__log = [] if logBit else None
+        # summary: first message, names of the visited routers and last message. 
+        # Messages are kept as (template, args) and only formatted when printed
+        self.__first = None
+        self.__visited = None
+        self.__last = None
+        self.__trace = None
         self.retransmitNext = None
         self.retransmit = retransmit
         self.__timeSent = -1000000
@@ -656,20 +1507,47 @@ class Packet:
         if self.__network == None:
             raise CustomError("Packet is not on a network!")
 
+    def clone(self) -> Packet:
+        """Copies the header and carries the log and summary over, without touching the network.
+        Log entries and summary messages are immutable, so they are shared rather than copied."""
+        p = Packet.__new__(Packet)
+        p.src = self.src
+        p.dst = self.dst
+        p.acked = self.acked
+        p.intermedIP = self.intermedIP
+        p.retransmitNext = None
+        p.retransmit = self.retransmit
+        p.rtCount = self.rtCount
+        p.packetID = self.packetID
+        p.status = self.status
+        p.__log = None if self.__log == None else self.__log.copy()
+        p.__first = self.__first
+        p.__visited = None if self.__visited == None else self.__visited.copy()
+        p.__last = self.__last
+        p.__timeSent = self.__timeSent
+        p.__timeStamp = self.__timeStamp
+        p.__network = self.__network
+        p.__trace = self.__trace
+        return p
+
     def refresh(self, router: Router):
+        """Readies a retransmitted copy: sent again from the start, the way it first went."""
+        if self.acked:
+            self.src, self.dst = self.dst, self.src
+            self.acked = False
         self.__timeSent = -1000000
         self.__timeStamp = -1000000
 
         self.configure(FRESH, router.getNetwork())
 
     def setStatus(self, status: Status):
-        self.configure(status, self.__network)
+        self.status = status
 
     def getStatus(self) -> Status:
         return self.status
 
     def getStatusStr(self):
-        return str(self.status)[7:]
+        return statusStr(self.status)
     
     def incrTimeStamp(self):
         self.networkCheck()
@@ -695,24 +1573,43 @@ class Packet:
         self.configure(self.status, network)
 
     ###LOGGING METHODS
-    def log(self, who, msg):
-        if type(who) != Link and self.getStatus() not in [DROP, FRESH, PROCESSED]:
-            self.__summary[1].append(who.getName())
-        logInfo = f"TIMESTAMP {self.__network.getTime()}: {self} is at {who}.\n{' ' * (len(' TIMESTAMP ') + len(str(self.__network.getTime())))}Message: {msg}"
-        if self.__logBit:
-            self.__log.append(logInfo)
-        if self.getStatus() == PROCESSED:
-            self.__summary[0] = msg
-        if self.getStatus() == DROP or self.getStatus() == RECV:
-            self.__summary[2] = msg
+    def log(self, who, msg: str, *args):
+        """Records an event at a router or link. msg is formatted with args only when printed."""
+        status = self.status
+        if type(who) != Link and status != DROP and status != FRESH and status != PROCESSED:
+            if self.__visited == None:
+                self.__visited = []
+            self.__visited.append(who.getName())
+        if self.__log != None:
+            self.__log.append((self.__network.getTime(), status, self.src, self.dst, who, msg, args))
+        if self.__trace != None:
+            self.__trace.record(self, who, msg)
+        if status == PROCESSED:
+            self.__first = (msg, args)
+        if status == DROP or status == RECV:
+            self.__last = (msg, args)
+
+    def setTrace(self, sink):
+        self.__trace = sink
+
+    @staticmethod
+    def __message(entry):
+        if entry == None:
+            return None
+        msg, args = entry
+        return msg.format(*args) if args else msg
+
+    def __formatLog(self, entry):
+        t, status, src, dst, who, msg, args = entry
+        return formatLogLine(t, describePacket(src, dst, status, self.packetID), who, Packet.__message((msg, args)))
             
     def printLog(self):
-        for m in self.__log:
-            print(m)
+        for m in self.__log or ():
+            print(self.__formatLog(m))
 
     def printLogLast(self):
         if not self.__log: print("No log yet.")
-        else: print(self.__log[-1])    
+        else: print(self.__formatLog(self.__log[-1]))    
     def printLogRec(self):
         n = self
         i = 0
@@ -722,15 +1619,60 @@ class Packet:
             i += 1
 
     def printSummary(self):
-        print(f"{self} summary:")
-        print("-", self.__summary[0])
-        travelPath = ','.join(self.__summary[1])
-        print("-", "Visisted nodes: " + travelPath)
-        print("-", self.__summary[2])
-        print("-", "Time sent:", self.getTimeSent(), "\n- Last logged time:", self.getTimeStamp())
+        printSummary(self, Packet.__message(self.__first), 
+                     self.__visited or [],
+                     Packet.__message(self.__last), self.getTimeSent(), self.getTimeStamp())
 
     def __repr__(self):
-        return f"Packet(SRC: {self.src}; DST: {self.dst}; STATUS: {self.getStatusStr()}; ID: {self.packetID})"
+        return describePacket(self.src, self.dst, self.status, self.packetID)
+
+    def __getstate__(self):
+        state = {s: getattr(self, s) for s in _PACKET_SLOTS if hasattr(self, s)}
+        state['_Packet__trace'] = None
+        return None, state
+
+_PACKET_SLOTS = [('_Packet' + s) if s.startswith('__') else s for s in Packet.__slots__]
+
+#region forking
+_FORK_SHARED = {} #id -> object shared with the network being forked, only set while it is unpickled
+
+def _forkShared(key: int):
+    return _FORK_SHARED[key]
+
+class _ForkPickler(pickle.Pickler):
+    """Pickles a network for fork, referring to the shared objects and to finished packets instead of copying them."""
+    def __init__(self, file, shared: dict, inFlight: set):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.shared = shared
+        self.inFlight = inFlight
+
+    def reducer_override(self, obj):
+        key = id(obj)
+        if key in self.shared:
+            return _forkShared, (key,)
+        if type(obj) == Packet and obj not in self.inFlight:
+            self.shared[key] = obj
+            return _forkShared, (key,)
+        return NotImplemented
+#endregion
+
+#region log formatting, shared with Trace.py
+def statusStr(status: Status):
+    return '' if status == None else status.name
+
+def describePacket(src: str, dst: str, status: Status, packetID: int):
+    return f"Packet(SRC: {src}; DST: {dst}; STATUS: {statusStr(status)}; ID: {packetID})"
+
+def formatLogLine(t: int, packetDesc: str, who, message: str):
+    return f"TIMESTAMP {t}: {packetDesc} is at {who}.\n{' ' * (len(' TIMESTAMP ') + len(str(t)))}Message: {message}"
+
+def printSummary(packetDesc, first: str, visited: list[str], last: str, timeSent: int, timeStamp: int):
+    print(f"{packetDesc} summary:")
+    print("-", first)
+    print("-", "Visisted nodes: " + ','.join(visited))
+    print("-", last)
+    print("-", "Time sent:", timeSent, "\n- Last logged time:", timeStamp)
+#endregion
     
 
 class Attacker(Router): 
@@ -742,7 +1684,7 @@ class Attacker(Router):
         self.failureCond = failureCond
 
     def updateRoutingTable(self):
-        self.__nextHopVector = defaultdict(lambda: None)
+        self.__nextHopVector = defaultdict(_noHop)
     
     def setRoutingAlgorithm(self, algorihtm):
         return
@@ -756,10 +1698,10 @@ class Attacker(Router):
             )
 
     def reportHop(self, _):
-        links = self.getLinks()
+        links = self.getLinks() #not the adjacency, which probers coming and going keep stale
         if not len(links):
             raise CustomError("Isolated node detected!")
-        random.shuffle(links)
+        self.getNetwork().rng.shuffle(links)
         return links[0]
              
 class Defender(Router):
@@ -1,46 +1,233 @@
-from collections import defaultdict
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+from functools import partial
+import hashlib
 import heapq
-import random
+import math
+import os
+import shutil
+import tempfile
+import weakref
 import numpy as np
 
+class NextHopTable(Mapping):
+    """
+    Read only {destination name: next hop name} view over a name list and 
+    index shared by many routers, and one int array of next hop indices 
+    (-1 when unreachable). Unknown names raise KeyError like the dict it replaces.
+    """
+    __slots__ = ('names', 'index', 'hops')
+    def __init__(self, names: list, index: dict, hops):
+        self.names = names
+        self.index = index
+        self.hops = hops
+
+    def __getitem__(self, name):
+        h = self.hops[self.index[name]]
+        return None if h < 0 else self.names[h]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def hopIndex(self, name) -> int:
+        return int(self.hops[self.index[name]])
+
+    def hopCounts(self):
+        """Indices of the next hops used and how many destinations use each."""
+        hops, counts = np.unique(self.hops[self.hops >= 0], return_counts=True)
+        return hops.tolist(), counts.tolist()
+
+    def __reduce__(self):
+        return _rowView(NextHopTable, self.names, self.index, self.hops)
+
+class CompressedNextHops:
+    """
+    Next hop rows, run-length encoded. Destinations are laid out in depth first 
+    order over the links, where the ones behind the same first hop tend to be 
+    next to each other, and a row only keeps where each run starts and its hop. 
+    Against the dense int16 matrix that is about 20x smaller on grids, 2x on 
+    sparse random graphs, and no better on geometric ones with long links.
+    """
+    def __init__(self, order):
+        n = len(order)
+        self.order = np.asarray(order, dtype=np.int64)
+        pos = np.empty(n, dtype=np.int64)
+        pos[self.order] = np.arange(n)
+        self.pos = pos.tolist()
+        self.startType = 'H' if n < 1 << 16 else 'l'
+        self.hopType = 'h' if n < 1 << 15 else 'l'
+        self.starts = [array(self.startType)] * n
+        self.values = [array(self.hopType)] * n
+
+    def setRow(self, s: int, first):
+        row = np.asarray(first)[self.order]
+        starts = np.flatnonzero(np.concatenate(([True], row[1:] != row[:-1])))
+        self.starts[s] = array(self.startType, starts.tolist())
+        self.values[s] = array(self.hopType, row[starts].tolist())
+
+    def hop(self, s: int, i: int) -> int:
+        return self.values[s][bisect_right(self.starts[s], self.pos[i]) - 1]
+
+    def row(self, s: int):
+        """The row decoded, indexed by destination."""
+        starts = np.asarray(self.starts[s], dtype=np.int64)
+        lengths = np.diff(np.append(starts, len(self.pos)))
+        return np.repeat(np.asarray(self.values[s], dtype=np.int64), lengths)[np.asarray(self.pos)]
+
+    def runs(self, s: int):
+        """(hops, run lengths) of a row."""
+        starts = np.asarray(self.starts[s], dtype=np.int64)
+        return np.asarray(self.values[s], dtype=np.int64), np.diff(np.append(starts, len(self.pos)))
+
+    def hopCounts(self, s: int):
+        hops, lengths = self.runs(s)
+        counts = np.bincount(hops[hops >= 0], weights=lengths[hops >= 0], minlength=len(self.pos))
+        used = np.flatnonzero(counts)
+        return used.tolist(), counts[used].astype(np.int64).tolist()
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in self.starts) + sum(a.itemsize * len(a) for a in self.values)
+
+class StoredNextHopTable(Mapping):
+    """
+    NextHopTable over one row of a store that keeps or computes its rows, 
+    a CompressedNextHops or LazyRoutes, following its later recomputations.
+    """
+    __slots__ = ('names', 'index', 'store', 'row')
+    def __init__(self, names: list, index: dict, store, row: int):
+        self.names = names
+        self.index = index
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, name):
+        h = self.store.hop(self.row, self.index[name])
+        return None if h < 0 else self.names[h]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def hopIndex(self, name) -> int:
+        return self.store.hop(self.row, self.index[name])
+
+    def hopCounts(self):
+        return self.store.hopCounts(self.row)
+
+# tables whose next hops can be read by index, see Router.forwardAll
+INDEX_TABLES = (NextHopTable, StoredNextHopTable)
+
+class DistanceTable(Mapping):
+    """Read only {router: distance} view over a shared router index and one row of distances."""
+    __slots__ = ('routers', 'index', 'dist')
+    def __init__(self, routers: list, index: dict, dist):
+        self.routers = routers
+        self.index = index
+        self.dist = dist
+
+    def __getitem__(self, router):
+        return float(self.dist[self.index[router.getIP()]])
+
+    def __iter__(self):
+        return iter(self.routers)
+
+    def __len__(self):
+        return len(self.routers)
+
+    def __reduce__(self):
+        return _rowView(DistanceTable, self.routers, self.index, self.dist)
+
+class StoredDistanceTable(Mapping):
+    """DistanceTable over one row of a LazyRoutes."""
+    __slots__ = ('routers', 'index', 'store', 'row')
+    def __init__(self, routers: list, index: dict, store, row: int):
+        self.routers = routers
+        self.index = index
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, router):
+        return self.store.distance(self.row, self.index[router.getIP()])
+
+    def __iter__(self):
+        return iter(self.routers)
+
+    def __len__(self):
+        return len(self.routers)
+
+def _rowView(cls, keys, index, row):
+    """Pickles a table over a row of a shared 2D array as that array and a row number, 
+    so that the array is stored once and the table is a view on it again once loaded."""
+    base = row.base if isinstance(row, np.ndarray) else None
+    if base is None or base.ndim != 2 or base.shape[1] != len(row) or base.strides[1] != row.strides[0]:
+        return (cls, (keys, index, row))
+    offset = row.__array_interface__['data'][0] - base.__array_interface__['data'][0]
+    return (_tableOnRow, (cls, keys, index, base, offset // base.strides[0]))
+
+def _tableOnRow(cls, keys, index, base, i):
+    return cls(keys, index, base[i])
+
 def Dijkstra(network, startRouter):
-    dist = {router: float('infinity') for router in network.getNodes()}
-    prevNodes = {router: None for router in network.getNodes()}
-    dist[startRouter] = 0
+    adj = network.getAdjacency()
+    routers = adj.routers
+    indptr, neighbors, weights = adj.lists()
+    rank = adj.ranks()
+    dist = [float('infinity')] * len(routers)
+    prevNodes = [-1] * len(routers)
+    start = adj.index[startRouter.getIP()]
+    dist[start] = 0
 
-    pQ = [(0, startRouter)]
+    pQ = [(0, rank[start], start)] #ties broken by name, as routers compare
 
     while pQ:
-        curDist, curRouter = heapq.heappop(pQ)
+        curDist, _, cur = heapq.heappop(pQ)
         
-        for link in curRouter.getLinks():
-            u, v = link.getEndpoints()
-            neighbor = v if curRouter == u else u
-            weight = link.weight
-            distThruCur = curDist + weight
+        for e in range(indptr[cur], indptr[cur + 1]):
+            neighbor = neighbors[e]
+            if neighbor < 0: #the other end is not on the network
+                continue
+            distThruCur = curDist + weights[e]
             if distThruCur < dist[neighbor]:
                 dist[neighbor] = distThruCur
-                prevNodes[neighbor] = curRouter
-                heapq.heappush(pQ, (distThruCur, neighbor))
-    return dist, prevNodes
+                prevNodes[neighbor] = cur
+                heapq.heappush(pQ, (distThruCur, rank[neighbor], neighbor))
+    return ({r: d for r, d in zip(routers, dist)}, 
+            {r: None if p < 0 else routers[p] for r, p in zip(routers, prevNodes)})
 
 
 def DijkstraNextHopDist(network, startRouter):
+    adj = network.getAdjacency() #routers in the order Dijkstra returns them, names shared by all tables
     dist, prevNodes = Dijkstra(network, startRouter)
-    nextHopVector = defaultdict(lambda _: None)
-    for dst in prevNodes:
+    routers = list(prevNodes)
+    index = {r: i for i, r in enumerate(routers)}
+    hops = np.full(len(routers), -1, dtype=np.int32)
+    ###one pass over the tree: a node inherits its parent's first hop,
+    ###the children of the start router being their own first hop
+    done = np.zeros(len(routers), dtype=bool)
+    done[index[startRouter]] = True
+    hops[index[startRouter]] = index[startRouter]
+    for dst in routers:
+        path = []
         curNode = dst
-        prev = dst
-        while curNode != startRouter: 
-            prev = curNode
-            if prev == None:
-                break
+        while curNode != None and not done[index[curNode]]:
+            path.append(index[curNode])
             curNode = prevNodes[curNode]
-        nextHopVector[dst] = prev
-    d = {}
-    for to, hop in nextHopVector.items():
-        d[to.getName()] = None if hop == None else hop.getName()
-    return d, dist
+        if curNode == None:
+            hop = -1
+        elif curNode == startRouter:
+            hop = path[-1] if path else hops[index[curNode]]
+        else:
+            hop = hops[index[curNode]]
+        hops[path] = hop
+        done[path] = True
+    return NextHopTable(adj.names, adj.nameIndex, hops), dist
 
 def DijkstraNextHop(network, startRouter):
     return DijkstraNextHopDist(network, startRouter)[0]
@@ -48,13 +235,630 @@ def DijkstraNextHop(network, startRouter):
 def ProbabilisticDijkstra(network, startRouter):
     # startRouter.setAuxiliary(DijkstraNextHop, network, startRouter)
     res, dist = DijkstraNextHopDist(network, startRouter)
-    def select_random_node(vec):
-        nodes = list(vec.values())
-        weights = np.array([1 / dist[network.getNode(node)] if node != startRouter.getName() else 0 for node in nodes])
-        weights /= np.sum(weights)
-        if not nodes: return None
-        chosenNode = random.choices(nodes, weights=weights, k=1)[0]
-        return chosenNode
-
-    startRouter.setHopWrapper(lambda vec, _: select_random_node(vec))
-    return res
\ No newline at end of file
+    return ProbabilisticFromPaths(network, startRouter, res, dist)
+
+def ProbabilisticFromPaths(network, startRouter, res, dist):
+    """
+    Installs a hop wrapper that ignores the destination and picks a next hop at random, 
+    with odds proportional to 1 / distance. The candidates, set by network.randomHops, 
+    are the hops the table uses, each counted once per destination it is used for (None), 
+    every neighbour ('neighbors'), or the k likeliest of the former (an int k). 
+    They are sampled from an alias table made here, so each pick is O(1).
+    """
+    names, counts = _hopCounts(res)
+    mode = network.randomHops
+    if mode == 'neighbors':
+        adj = network.getAdjacency()
+        i = adj.index[startRouter.getIP()]
+        names = list({adj.routers[j].getName() for j in adj.neighbors[adj.indptr[i]:adj.indptr[i + 1]].tolist() if j >= 0})
+        counts = [1] * len(names)
+    own = startRouter.getName()
+    items, weights = [], []
+    for name, count in zip(names, counts):
+        if name != own:
+            d = dist[network.getNode(name)]
+            items.append(name)
+            weights.append(count / d if d > 0 else math.inf)
+    if type(mode) == int and mode < len(items):
+        best = sorted(range(len(items)), key=lambda i: -weights[i])[:mode]
+        items, weights = [items[i] for i in best], [weights[i] for i in best]
+    startRouter.setHopWrapper(partial(_sampleHop, network, AliasTable(items, weights)))
+    return res
+
+def _hopCounts(res):
+    """Next hop names in the table and how many destinations use each."""
+    if type(res) in INDEX_TABLES:
+        hops, counts = res.hopCounts()
+        return [res.names[h] for h in hops], counts
+    counts = defaultdict(int)
+    for hop in res.values():
+        if hop != None:
+            counts[hop] += 1
+    return list(counts), list(counts.values())
+
+def _sampleHop(network, table, vec, _):
+    return table.sample(network.rng)
+
+class AliasTable:
+    """
+    Vose's alias method: draws items[i] with probability weights[i] / sum(weights) 
+    in O(1) from a single uniform. Infinite weights share all the odds equally.
+    """
+    __slots__ = ('items', 'prob', 'alias')
+    def __init__(self, items: list, weights: list):
+        n = len(items)
+        self.items = list(items)
+        if any(math.isinf(w) for w in weights):
+            weights = [1.0 if math.isinf(w) else 0.0 for w in weights]
+        total = sum(weights)
+        scaled = [w * n / total for w in weights] if total > 0 else [1.0] * n
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+    def sample(self, rng):
+        if not self.items:
+            return None
+        u = rng.random() * len(self.items)
+        i = int(u)
+        return self.items[i] if u - i < self.prob[i] else self.items[self.alias[i]]
+
+    def __len__(self):
+        return len(self.items)
+
+
+#region batch routing
+# Largest graph for which the Floyd-Warshall path is tried, and the smallest 
+# edge density (directed edges / N^2) for which it beats N Dijkstra runs.
+FW_MAX_NODES = 400
+FW_MIN_DENSITY = 0.1
+
+def _linkWeight(network, router, ip):
+    # lightest link from router to the router with the given ip, as Dijkstra sees it
+    adj = network.getAdjacency()
+    i, j = adj.index[router.getIP()], adj.index.get(ip)
+    lo, hi = adj.indptr[i], adj.indptr[i + 1]
+    w = adj.weights[lo:hi][adj.neighbors[lo:hi] == j]
+    return float(w.min()) if len(w) else float('infinity')
+
+def _adjacency(network, routers: list = None):
+    # one {neighbor index: weight} dict per router, from each router's own 
+    # link set exactly as Dijkstra walks it. Parallel links keep the lightest 
+    # weight; infinite weights and self loops are left out. With routers, 
+    # indices are into that list instead, and routers no longer on the 
+    # network have no links.
+    adj = network.getAdjacency()
+    indptr, neighbors, weights = adj.lists()
+    if routers == None:
+        routers, ours = adj.routers, None
+    else:
+        index = {r.getIP(): i for i, r in enumerate(routers)}
+        ours = [index.get(r.getIP(), -1) for r in adj.routers]
+    rows = []
+    for k, r in enumerate(routers):
+        i = adj.index.get(r.getIP())
+        best = {}
+        if i != None:
+            for e in range(indptr[i], indptr[i + 1]):
+                j, w = neighbors[e], weights[e]
+                if ours != None and j >= 0:
+                    j = ours[j]
+                if j < 0 or j == k or w == float('infinity'):
+                    continue
+                if j not in best or w < best[j]:
+                    best[j] = w
+        rows.append(best)
+    return list(routers), rows
+
+def BuildCSR(network):
+    """
+    Snapshot of the topology as a directed CSR graph over router indices.
+    Returns (routers, indptr, indices, weights).
+    """
+    routers, rows = _adjacency(network)
+    indptr = np.zeros(len(routers) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((j for row in rows for j in row), dtype=np.int64, count=indptr[-1])
+    weights = np.array([w for row in rows for w in row.values()], dtype=np.float64)
+    return routers, indptr, indices, weights
+
+class Adjacency:
+    """
+    CSR arrays over the routers' links, as Network.getAdjacency keeps them: the links 
+    of routers[i] are entries indptr[i] to indptr[i + 1], in the order the router 
+    holds them, each with the neighbour's index (-1 if it is not on the network), 
+    the link's index and weight, and the Link itself in links. names and nameIndex 
+    are the routers' names and their indices, shared by the NextHopTables made 
+    for this version of the topology.
+    """
+    def __init__(self, network):
+        self.version = network.topologyVersion
+        self.routers = network.getNodes()
+        self.index = {r.getIP(): i for i, r in enumerate(self.routers)}
+        self.names = [r.getName() for r in self.routers]
+        self.nameIndex = {name: i for i, name in enumerate(self.names)}
+        links, neighbors = [], []
+        indptr = [0]
+        for i, r in enumerate(self.routers):
+            ip = r.getIP()
+            for id in r.getLinksRaw():
+                link = network.getLink(id)
+                links.append(link)
+                neighbors.append(self.index.get(link.v if ip == link.u else link.u, -1))
+            indptr.append(len(links))
+        self.links = links
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.neighbors = np.array(neighbors, dtype=np.int64)
+        self.linkIndices = np.array([l.getIndex() for l in links], dtype=np.int64)
+        self.weights = np.array([l.weight for l in links], dtype=np.float64)
+        self.__lists = None
+        self.__ranks = None
+
+    def lists(self):
+        """(indptr, neighbors, weights) as lists, quicker than arrays to index one at a time."""
+        if self.__lists == None:
+            self.__lists = (self.indptr.tolist(), self.neighbors.tolist(), self.weights.tolist())
+        return self.__lists
+
+    def ranks(self):
+        if self.__ranks == None:
+            self.__ranks = _nameRanks(self.routers)
+        return self.__ranks
+
+    def linksOf(self, router) -> list:
+        i = self.index[router.getIP()]
+        return self.links[self.indptr[i]:self.indptr[i + 1]]
+
+    def setWeight(self, link):
+        """Patches the weight of a link already in the arrays."""
+        for ip in (link.u, link.v):
+            i = self.index.get(ip)
+            if i == None:
+                continue
+            lo = self.indptr[i]
+            for e in np.flatnonzero(self.linkIndices[lo:self.indptr[i + 1]] == link.getIndex()):
+                self.weights[lo + e] = link.weight
+        self.__lists = None
+
+def _nameRanks(routers):
+    # Dijkstra breaks distance ties on the heap by router name
+    rank = [0] * len(routers)
+    for r, i in enumerate(sorted(range(len(routers)), key=lambda i: routers[i].getName())):
+        rank[i] = r
+    return rank
+
+def _dijkstraFirstHops(s, adj, rank):
+    # Same relaxation order as Dijkstra, on indices. A node's first hop is 
+    # inherited from its parent when it is relaxed; the parent is final by then.
+    dist = [float('infinity')] * len(adj)
+    first = [-1] * len(adj)
+    parent = [-1] * len(adj)
+    dist[s] = 0
+    first[s] = s
+    pQ = [(0, rank[s], s)]
+    while pQ:
+        d, _, u = heapq.heappop(pQ)
+        if d > dist[u]:
+            continue
+        hop = first[u]
+        for v, w in adj[u].items():
+            distThruCur = d + w
+            if distThruCur < dist[v]:
+                dist[v] = distThruCur
+                parent[v] = u
+                first[v] = v if u == s else hop
+                heapq.heappush(pQ, (distThruCur, rank[v], v))
+    return dist, first, parent
+
+def FloydWarshall(W):
+    """All pairs distances for a dense weight matrix (np.inf where there is no edge)."""
+    D = W.copy()
+    np.fill_diagonal(D, 0)
+    for k in range(len(D)):
+        np.minimum(D, D[:, k, None] + D[None, k, :], out=D)
+    return D
+
+def _floydWarshallFirstHops(W, rank, blockSize: int = 1 << 22):
+    # Only valid for strictly positive weights: Dijkstra then pops nodes in 
+    # (dist, name) order, so a node's parent is its earliest popped predecessor
+    # on a shortest path, and its first hop is found by pointer jumping.
+    n = len(W)
+    D = FloydWarshall(W)
+    rank = np.asarray(rank)
+    idx = np.arange(n)
+    parent = np.full((n, n), -1, dtype=np.int64)
+    step = max(1, blockSize // max(1, n * n))
+    for s0 in range(0, n, step):
+        Ds = D[s0:s0 + step]
+        pos = np.empty_like(Ds, dtype=np.int64)
+        for b in range(len(Ds)):
+            pos[b, np.lexsort((rank, Ds[b]))] = idx
+        onPath = ((Ds[:, :, None] + W[None, :, :] == Ds[:, None, :]) 
+                  & np.isfinite(Ds)[:, :, None] & np.isfinite(Ds)[:, None, :])
+        key = np.where(onPath, pos[:, :, None], n)
+        best = key.argmin(axis=1)
+        found = np.take_along_axis(key, best[:, None, :], axis=1)[:, 0, :] < n
+        parent[s0:s0 + step] = np.where(found, best, -1)
+    parent[idx, idx] = -1
+    anc = np.where((parent == idx[:, None]) | (parent < 0), idx[None, :], parent)
+    while True:
+        nxt = np.take_along_axis(anc, anc, axis=1)
+        if np.array_equal(nxt, anc):
+            break
+        anc = nxt
+    first = np.where(np.isfinite(D), anc, -1)
+    return D, first, parent
+
+class RoutingState:
+    """
+    Dijkstra's distances, parents and first hops from every router to every 
+    router, computed in one batch and kept so that later link changes only 
+    recompute the sources whose shortest path tree they can change.
+    Small dense graphs with positive integer weights go through vectorized 
+    Floyd-Warshall, anything else through one index based Dijkstra per source.
+    Ties are broken exactly as in Dijkstra.
+    A forked network shares the arrays with its parent until either side 
+    has to change them, see unshare.
+    Hops and parents are int16 while indices fit. With a path the matrices are 
+    memory mapped .npy files in that directory. With compressed the next hops 
+    are kept in a CompressedNextHops instead of the first matrix, and dist and 
+    parent, which only link changes and distance lookups read, are always memory 
+    mapped, from temporary files if there is no path, so they stay out of RAM.
+    With a cache directory the matrices of a topology are saved there once and 
+    loaded instead of computed when the same topology comes again, see _routeKey.
+    """
+    def __init__(self, network, path: str = None, compressed: bool = False, cache: str = None):
+        self.routers, self.adj = _adjacency(network)
+        n = len(self.routers)
+        self.index = {r.getIP(): i for i, r in enumerate(self.routers)}
+        self.rank = _nameRanks(self.routers)
+        self.names = [r.getName() for r in self.routers]
+        self.nameIndex = {name: i for i, name in enumerate(self.names)}
+        weights = [w for row in self.adj for w in row.values()]
+        self.shared = False
+        useFW = (0 < n <= FW_MAX_NODES and len(weights) >= FW_MIN_DENSITY * n * n 
+                 and all(w == math.floor(w) and w > 0 for w in weights))
+        loaded = None
+        if cache != None:
+            key, canon = _routeKey(self.names, self.adj)
+            loaded = _loadRoutes(cache, key, canon)
+        self.cached = loaded != None
+        self.path = path
+        if self.cached and path == None and not compressed:
+            self.dist, self.first, self.parent = loaded
+            self.hops = None
+            return
+        hopType = np.int16 if n < 1 << 15 else np.int32
+        if compressed and path == None:
+            self.dist = _scratchMatrix(None, 'dist', n, np.float64, np.inf)
+            self.parent = _scratchMatrix(None, 'parent', n, hopType, -1)
+        else:
+            self.dist = _matrix(path, 'dist', n, np.float64, np.inf)
+            self.parent = _matrix(path, 'parent', n, hopType, -1)
+        self.first = None if compressed else _matrix(path, 'first', n, hopType, -1)
+        self.hops = CompressedNextHops(_depthFirstOrder(self.adj)) if compressed else None
+        if useFW or self.cached:
+            if self.cached:
+                D, first, parent = loaded
+            else:
+                W = np.full((n, n), np.inf)
+                for i, row in enumerate(self.adj):
+                    W[i, list(row)] = list(row.values())
+                D, first, parent = _floydWarshallFirstHops(W, self.rank)
+            self.dist[:] = D
+            self.parent[:] = parent
+            if compressed:
+                for s in range(n):
+                    self.hops.setRow(s, first[s])
+            else:
+                self.first[:] = first
+        else:
+            self.recompute(range(n))
+        if cache != None and not self.cached:
+            _saveRoutes(cache, key, canon, self)
+
+    def sharedArrays(self) -> list:
+        """The arrays a fork shares until unshare."""
+        return [a for a in (self.dist, self.first, self.parent) if a is not None]
+
+    def unshare(self):
+        """
+        Copies the arrays shared with a fork, into new files under path if they are 
+        memory mapped ones. Tables handed out before are views on the old ones.
+        """
+        if self.path != None or self.hops != None:
+            copy = lambda name, a: _scratchMatrix(self.path, name, len(a), a.dtype, a)
+        else:
+            copy = lambda name, a: np.array(a)
+        self.dist = copy('dist', self.dist)
+        self.parent = copy('parent', self.parent)
+        if self.first is not None:
+            self.first = copy('first', self.first)
+        self.shared = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shared'] = False
+        return state
+
+    def recompute(self, rows):
+        for s in rows:
+            dist, first, parent = _dijkstraFirstHops(s, self.adj, self.rank)
+            self.dist[s] = dist
+            self.parent[s] = parent
+            if self.hops != None:
+                self.hops.setRow(s, first)
+            else:
+                self.first[s] = first
+
+    def update(self, network, ipPairs) -> list:
+        """
+        Brings the state up to date after the links between the given ip pairs 
+        changed, and returns the routers whose tables had to be recomputed.
+        A lighter edge can only matter to sources that reach it on or under a 
+        shortest path, a heavier or removed one only to sources whose tree uses it.
+        """
+        affected = np.zeros(len(self.routers), dtype=bool)
+        for ipA, ipB in ipPairs:
+            a, b = self.index.get(ipA), self.index.get(ipB)
+            if a == None or b == None or a == b:
+                continue
+            for x, y in ((a, b), (b, a)):
+                w = _linkWeight(network, self.routers[x], self.routers[y].getIP())
+                old = self.adj[x].get(y, float('infinity'))
+                if w == old:
+                    continue
+                if w < old:
+                    reach = self.dist[:, x]
+                    affected |= np.isfinite(reach) & (reach + w <= self.dist[:, y])
+                else:
+                    affected |= self.parent[:, y] == x
+                if w == float('infinity'):
+                    del self.adj[x][y]
+                else:
+                    self.adj[x][y] = w
+        rows = np.flatnonzero(affected).tolist()
+        self.recompute(rows)
+        return [self.routers[s] for s in rows]
+
+    def tableFor(self, router):
+        """
+        Returns (nextHops, dist) as DijkstraNextHopDist would, as views on 
+        this state's rows: they follow later in place recomputations.
+        """
+        s = self.index[router.getIP()]
+        if self.hops != None:
+            hops = StoredNextHopTable(self.names, self.nameIndex, self.hops, s)
+        else:
+            hops = NextHopTable(self.names, self.nameIndex, self.first[s])
+        return hops, DistanceTable(self.routers, self.index, self.dist[s])
+
+class LazyRoutes:
+    """
+    RoutingState computed on demand: nothing is done up front, and a router's row 
+    (distances, parents and first hops, one index based Dijkstra) is computed the 
+    first time one of its lookups needs it. Rows are kept in an LRU cache of at 
+    most budget bytes; the least recently used ones are dropped to make room and 
+    computed again if needed. Link changes only drop the cached rows whose tree 
+    they can change, with the same test as RoutingState.update.
+    """
+    def __init__(self, network, budget: int):
+        self.network = network
+        self.routers = network.getNodes()
+        self.index = {r.getIP(): i for i, r in enumerate(self.routers)}
+        self.names = [r.getName() for r in self.routers]
+        self.nameIndex = {name: i for i, name in enumerate(self.names)}
+        self.budget = budget
+        self.adj = None #built with the first row
+        self.rank = None
+        self.rows = OrderedDict() #source index -> (first, dist, parent), least recently used first
+        self.evicted = set() #rows dropped since the last update
+        self.computed = 0
+        self.shared = False
+        n = len(self.routers)
+        self.hopType = 'h' if n < 1 << 15 else 'l'
+        self.rowBytes = n * (2 * array(self.hopType).itemsize + 8)
+
+    def sharedArrays(self) -> list:
+        return [] #rows are small, a fork copies them
+
+    def unshare(self):
+        self.shared = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shared'] = False
+        return state
+
+    def row(self, s: int):
+        r = self.rows.get(s)
+        if r != None:
+            self.rows.move_to_end(s)
+            return r
+        if self.adj == None:
+            self.adj = _adjacency(self.network, self.routers)[1]
+            self.rank = _nameRanks(self.routers)
+        dist, first, parent = _dijkstraFirstHops(s, self.adj, self.rank)
+        r = self.rows[s] = (array(self.hopType, first), array('d', dist), array(self.hopType, parent))
+        self.computed += 1
+        self.evicted.discard(s)
+        while len(self.rows) > 1 and len(self.rows) * self.rowBytes > self.budget:
+            self.evicted.add(self.rows.popitem(last=False)[0])
+        return r
+
+    def hop(self, s: int, i: int) -> int:
+        return self.row(s)[0][i]
+
+    def distance(self, s: int, i: int) -> float:
+        return self.row(s)[1][i]
+
+    def hopCounts(self, s: int):
+        hops, counts = np.unique(np.asarray(self.row(s)[0]), return_counts=True)
+        return hops[hops >= 0].tolist(), counts[hops >= 0].tolist()
+
+    def nbytes(self) -> int:
+        return len(self.rows) * self.rowBytes
+
+    def update(self, network, ipPairs) -> list:
+        """
+        Patches the adjacency after the links between the given ip pairs changed and 
+        drops the cached rows they can affect. Returns the routers of the rows dropped 
+        since the last update, by this or to make room: their tables are views that 
+        compute again on demand, but tables made from a row, e.g. probabilistic ones, 
+        have to be made again.
+        """
+        if self.adj != None:
+            for ipA, ipB in ipPairs:
+                a, b = self.index.get(ipA), self.index.get(ipB)
+                if a == None or b == None or a == b:
+                    continue
+                for x, y in ((a, b), (b, a)):
+                    w = _linkWeight(network, self.routers[x], self.routers[y].getIP())
+                    old = self.adj[x].get(y, float('infinity'))
+                    if w == old:
+                        continue
+                    for s, (_, dist, parent) in list(self.rows.items()):
+                        if (dist[x] < math.inf and dist[x] + w <= dist[y]) if w < old else parent[y] == x:
+                            del self.rows[s]
+                            self.evicted.add(s)
+                    if w == float('infinity'):
+                        del self.adj[x][y]
+                    else:
+                        self.adj[x][y] = w
+        stale = [self.routers[s] for s in sorted(self.evicted)]
+        self.evicted = set()
+        return stale
+
+    def tableFor(self, router):
+        """Returns (nextHops, dist) as views computing the router's row on first lookup."""
+        s = self.index[router.getIP()]
+        return (StoredNextHopTable(self.names, self.nameIndex, self, s), 
+                StoredDistanceTable(self.routers, self.index, self, s))
+
+def _matrix(path: str, name: str, n: int, dtype, fill):
+    if path == None:
+        return np.full((n, n), fill, dtype=dtype)
+    os.makedirs(path, exist_ok=True)
+    file = os.path.join(path, name + '.npy')
+    if os.path.exists(file):
+        os.remove(file) #arrays still mapped from it, e.g. by a fork, keep the old data
+    m = np.lib.format.open_memmap(file, 'w+', dtype, (n, n))
+    m[:] = fill
+    return m
+
+def _scratchMatrix(path: str, name: str, n: int, dtype, fill):
+    # a memory mapped matrix in a file of its own under path (the temporary directory 
+    # if None), filled with fill (a value or an array), and removed once unused
+    path = tempfile.gettempdir() if path == None else path
+    os.makedirs(path, exist_ok=True)
+    fd, file = tempfile.mkstemp('.npy', name + '-', path)
+    os.close(fd)
+    m = np.lib.format.open_memmap(file, 'w+', dtype, (n, n))
+    m[:] = fill
+    weakref.finalize(m, _removeFile, file)
+    return m
+
+def _removeFile(file: str):
+    try:
+        os.remove(file)
+    except OSError: #still mapped on Windows
+        pass
+
+# what RoutingState computes, part of every cache key so that changing it misses old entries
+ROUTE_CACHE_VERSION = b"RoutingState 2: Dijkstra, ties by name"
+
+def _routeKey(names: list, adj):
+    """
+    Hash of a topology as Dijkstra sees it: router names, and the lightest weight 
+    between every linked pair in both directions. It does not depend on the order 
+    routers or links were added in, since ties are broken by name: the saved 
+    matrices are in the order of the network that saved them, and canon (the 
+    position of each router among the names sorted) lets another order use them.
+    Returns (key, canon).
+    """
+    n = len(names)
+    canon = np.empty(n, dtype=np.int64)
+    canon[sorted(range(n), key=names.__getitem__)] = np.arange(n)
+    counts = [len(row) for row in adj]
+    u = canon[np.repeat(np.arange(n), counts)]
+    v = canon[np.fromiter((j for row in adj for j in row), dtype=np.int64, count=sum(counts))]
+    w = np.fromiter((x for row in adj for x in row.values()), dtype=np.float64, count=sum(counts))
+    order = np.lexsort((v, u))
+    h = hashlib.sha256(ROUTE_CACHE_VERSION)
+    h.update("\0".join(sorted(names)).encode())
+    for a in (u[order], v[order], w[order]):
+        h.update(b"\1" + a.tobytes())
+    return h.hexdigest(), canon
+
+def _loadRoutes(cache: str, key: str, canon):
+    # (dist, first, parent) of a cached topology, None if it is not there. Copy on write 
+    # maps when the routers are in the same order as when saved, permuted copies if not.
+    folder = os.path.join(cache, key)
+    try:
+        saved = np.load(os.path.join(folder, 'canon.npy'))
+        res = [np.load(os.path.join(folder, name + '.npy'), mmap_mode='c') for name in ('dist', 'first', 'parent')]
+    except (OSError, ValueError):
+        return None
+    if np.array_equal(saved, canon):
+        return res
+    where = np.empty(len(saved), dtype=np.int64)
+    where[saved] = np.arange(len(saved))
+    m = where[canon] #saved index of each router
+    back = np.empty(len(m), dtype=np.int64)
+    back[m] = np.arange(len(m))
+    dist, first, parent = (a[np.ix_(m, m)] for a in res)
+    first, parent = (np.where(a >= 0, back[a], -1).astype(a.dtype) for a in (first, parent))
+    return dist, first, parent
+
+def _saveRoutes(cache: str, key: str, canon, state):
+    folder = os.path.join(cache, key)
+    if os.path.isdir(folder):
+        return
+    n = len(canon)
+    first = state.first
+    if first is None:
+        first = np.array([state.hops.row(s) for s in range(n)], dtype=state.parent.dtype).reshape(n, n)
+    # written aside and renamed, so a run never loads a half written entry
+    tmp = "{}.{}.tmp".format(folder, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    for name, a in (('dist', state.dist), ('first', first), ('parent', state.parent), ('canon', canon)):
+        np.save(os.path.join(tmp, name + '.npy'), a)
+    try:
+        os.rename(tmp, folder)
+    except OSError: #saved by another run in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _depthFirstOrder(adj) -> list:
+    # preorder of every component in turn from its lowest index, lightest links first
+    order, seen = [], [False] * len(adj)
+    for root in range(len(adj)):
+        stack = [root]
+        while stack:
+            u = stack.pop()
+            if seen[u]:
+                continue
+            seen[u] = True
+            order.append(u)
+            stack.extend(v for v, _ in sorted(adj[u].items(), key=lambda e: (-e[1], -e[0])) if not seen[v])
+    return order
+
+def AllPairsNextHopDist(network, sources: list = None):
+    """Batch DijkstraNextHopDist for many routers at once. Returns {router: (nextHops, dist)}."""
+    state = RoutingState(network)
+    sources = state.routers if sources == None else sources
+    return {r: state.tableFor(r) for r in sources}
+
+# Routing algorithms RoutingState can stand in for, mapped to 
+# how a router's table is made from its (nextHops, dist)
+BATCH_ROUTING = {
+    DijkstraNextHop: lambda network, router, res, dist: res,
+    ProbabilisticDijkstra: ProbabilisticFromPaths,
+}
+#endregion
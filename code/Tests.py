@@ -1,8 +1,16 @@
 from debugpy import connect
 from NetworkObjects import *
 from RoutingAlgos import *
+from Trace import *
+from Experiments import *
+from Traffic import *
+from Detection import *
+from Topologies import erdosRenyi, grid, loadEdgeList, loadGraphML
 import numpy as np
+import os
 import random
+import shutil
+import time
 
 TEST_MSG_LEN = 70
 TEST_MSG_BUFFER = 14
@@ -49,15 +57,10 @@ def generateConnectedRandomGraph(n, maxW=10, connectivity=0.3, seed=None):
     if seed != None: random.seed()
     return nodes, d
 
-def generateTrustedNode(net: Network, to: str, name: str):
-    v = Router(name)
-    u = net.getNode(to)
-    l = Link(v.getIP(), u.getIP(), 0)
-    net.addNode(v)
-    net.addLink(l)
-    return v
-
-def testRouter(net: Network, nodeName: str, stopTime: int = 10) -> bool:
+def testRouter(net: Network, nodeName: str, stopTime: int = 10, fork: bool = False) -> bool:
+    """With fork the probe runs on a copy of the network, leaving net and its clock untouched."""
+    if fork:
+        net = net.fork()
     prober1 = "prober-" + str(generateRandomID())
     prober2 = "prober-" + str(generateRandomID())
     p1 = generateTrustedNode(net, nodeName, prober1)
@@ -66,14 +69,15 @@ def testRouter(net: Network, nodeName: str, stopTime: int = 10) -> bool:
     net.send(testPacket)
     net.updateTickTill(testPacket, DROP, stopTime)
     dropper = net.getNode(nodeName).reportHop(testPacket)
-    net.removeNode(p1)
-    net.removeNode(p2)
+    if not fork:
+        net.removeNode(p1)
+        net.removeNode(p2)
     return dropper == None
 
-def identifyDropperBasic(net: Network, packet: Packet, stopTime: int = 100) -> str:
+def identifyDropperBasic(net: Network, packet: Packet, stopTime: int = 100, fork: bool = False) -> str:
     cur = packet.src
     while cur != None:
-        ok = testRouter(net, cur, stopTime)
+        ok = testRouter(net, cur, stopTime, fork)
         cur = net.getNode(cur)
         if not ok: return cur
         cur = cur.reportHop(packet)
@@ -81,7 +85,7 @@ def identifyDropperBasic(net: Network, packet: Packet, stopTime: int = 100) -> s
     return None
 
 def sendTestPacket(net: Network, srcNode: Router = None, dstNode: Router = None, 
-                   tickCount: int = 200, waitDropperTick: int = 100):
+                   tickCount: int = 200, waitDropperTick: int = 100, verbose: bool = True):
     keepSrcNode = srcNode != None
     keepDstNode = dstNode != None
     res = None
@@ -95,7 +99,7 @@ def sendTestPacket(net: Network, srcNode: Router = None, dstNode: Router = None,
         # testPacket.printSummary()
         if (testPacket.getStatus() == DROP):
             res = identifyDropperBasic(net, testPacket, waitDropperTick)
-    if testPacket != None: testPacket.printSummary()
+    if verbose and testPacket != None: testPacket.printSummary()
     return res
 
 def sendTestPacketSupervised(gene, net: Network, srcNode: Router, dstNode: Router):
@@ -118,8 +122,10 @@ def makeSupervisionGene(net: Network, srcNode: Router, dstNode: Router):
     for node in set(net.getNodes()) - set([srcNode, dstNode]):
         l1 = Link(srcNode.getIP(), node.getIP(), 0)
         l2 = Link(dstNode.getIP(), node.getIP(), 0)
+        net.beginTopologyEdit()
         net.setLink(l1)
         net.setLink(l2)
+        net.commitTopologyEdit()
         # net.setLinkWeight((srcNode.getIP(), node.getIP()), 0)
         # net.setLinkWeight((dstNode.getIP(), node.getIP()), 0)
         srcNode.updateRoutingTable()
@@ -129,12 +135,26 @@ def makeSupervisionGene(net: Network, srcNode: Router, dstNode: Router):
         yield node
         l1 = Link(srcNode.getIP(), node.getIP(), np.inf)
         l2 = Link(dstNode.getIP(), node.getIP(), np.inf)
+        net.beginTopologyEdit()
         net.setLink(l1)
         net.setLink(l2)
+        net.commitTopologyEdit()
         # net.setLinkWeight((srcNode.getIP(), node.getIP()), np.inf)
         # net.setLinkWeight((dstNode.getIP(), node.getIP()), np.inf)
         node.updateRoutingTable()
 
+def edgesToAdjacency(nodes, src, dst, weights):
+    """Edge arrays as the name -> [(name, weight)] lists changeTopology_nnal takes."""
+    d = defaultdict(list)
+    for u, v, w in zip(src.tolist(), dst.tolist(), weights.tolist()):
+        d[nodes[u]].append((nodes[v], w))
+    return d
+
+def nextHops(net: Network) -> dict:
+    """Every router's next hop to every router, by name, to compare networks built differently."""
+    names = [r.getName() for r in net.getNodes()]
+    return {(a, b): net.getNode(a).getNextHopFor(b) for a in names for b in names}
+
 def basic_test1(): #basic: should complete round trip
     startMsg, endMsg = startEndTestMsg("Basic Test 1: Simple Network")
     print(startMsg)
@@ -195,6 +215,7 @@ def probe_test1(): #proof of concept probing
     testPacket.printSummary()
     res = identifyDropperBasic(net, testPacket)
     print("\nDropper identified to be:", res)
+    print("All path routers probed at once:", identifyDropperBatched(net, testPacket))
     print(endMsg)
 
 def probe_test2(): #randomized probing in dense networks
@@ -228,6 +249,23 @@ def probe_test3(): #supervisory node
     print("\nDropper identified to be:", sendTestPacketSupervised(geneRun, net, supervisor1, supervisor2))
     print(endMsg)
 
+def probe_test4(): #supervisory nodes testing groups of candidates
+    startMsg, endMsg = startEndTestMsg("Probing Test 4: Group Testing With Supervisors")
+    print(startMsg)
+    nodes, d = generateConnectedRandomGraph(100, 10, 0.1)
+    net = Network(10)
+    net.changeTopology_nnal(nodes, d)
+    for i in range(2):
+        net.addNode(Attacker('node-mal' + str(i)))
+    supervisor1 = Defender("supervisor1", np.inf)
+    net.addNode(supervisor1)
+    supervisor2 = Defender("supervisor2", np.inf)
+    net.addNode(supervisor2)
+    net.triggerNodesExplore()
+    droppers, rounds = superviseGroups(net, supervisor1, supervisor2, maxDroppers=2)
+    print("\nDroppers identified to be:", droppers, "in", rounds, "rounds")
+    print(endMsg)
+
 def random_path_test1():
     startMsg, endMsg = startEndTestMsg("Random Path Test 1: Proof of Concept")
     print(startMsg)
@@ -250,6 +288,338 @@ def random_path_test1():
     pack.printLogRec()
     print(endMsg)
 
+def randomHopOdds(net: Network, router: Router, mode) -> dict:
+    """Odds of each next hop ProbabilisticDijkstra should pick at the router, worked out 
+    from a fresh DijkstraNextHopDist the way the old hop wrapper weighed them."""
+    res, dist = DijkstraNextHopDist(net, router)
+    odds = defaultdict(float)
+    if mode == 'neighbors':
+        for l in router.getLinks():
+            n = net.getNodeFromIP(l.v if l.u == router.getIP() else l.u)
+            odds[n.getName()] = 1 / dist[n]
+    else:
+        for hop in res.values():
+            if hop != None and hop != router.getName():
+                odds[hop] += 1 / dist[net.getNode(hop)]
+        if type(mode) == int:
+            odds = dict(sorted(odds.items(), key=lambda e: -e[1])[:mode])
+    total = sum(odds.values())
+    return {n: w / total for n, w in odds.items()}
+
+def random_path_test2(): #sampled next hops should follow the odds for every randomHops mode
+    startMsg, endMsg = startEndTestMsg("Random Path Test 2: Next Hop Odds per Mode")
+    print(startMsg)
+    nodes, src, dst, weights = erdosRenyi(100, 4, seed=0)
+    samples = 20000
+    for mode in (None, 'neighbors', 2):
+        net = Network(seed=0)
+        net.routingDefault = ProbabilisticDijkstra
+        net.randomHops = mode
+        net.changeTopology_ea(nodes, src, dst, weights)
+        worst = 0
+        for r in net.getNodes()[:5]:
+            odds = randomHopOdds(net, r, mode)
+            picks = defaultdict(int)
+            for _ in range(samples):
+                picks[r.getNextHopFor(None)] += 1
+            if set(picks) - set(odds):
+                print("Mode", mode, "picked a hop it should not have at", r)
+            worst = max(worst, max(abs(picks[n] / samples - p) for n, p in odds.items()))
+        print("Mode", mode, "- largest gap between picked and expected odds: {:.4f}".format(worst))
+    print(endMsg)
+
+def event_test1(): #same as basic_test1, on the event driven engine
+    startMsg, endMsg = startEndTestMsg("Event Test 1: Simple Network, Event Engine")
+    print(startMsg)
+
+    nodes, d = setupBasic()
+    net = Network(40, engine=EVENT)
+    net.changeTopology_nnal(nodes, d)
+    testPacket = Packet("a", "e", True)
+    net.send(testPacket)
+    net.updateTickN(100)
+    testPacket.printSummary()
+    print(endMsg)
+
+def event_test2(): #link weights changed under packets: both engines should print the same
+    startMsg, endMsg = startEndTestMsg("Event Test 2: Weight Changes Mid-Flight")
+    print(startMsg)
+
+    for (u, v), w, rto in ((('b', 'c'), 50, 200), (('d', 'e'), np.inf, 40)):
+        for engine in (TICK, EVENT):
+            nodes, d = setupBasic()
+            net = Network(rto, engine=engine)
+            net.changeTopology_nnal(nodes, d)
+            testPacket = Packet("a", "e", True)
+            net.send(testPacket)
+            net.updateTickN(3)
+            net.setLinkWeight((net.getNodeIP(u), net.getNodeIP(v)), w)
+            net.updateTickN(300)
+            print(engine.name, "with", u, "<->", v, "at", w, "- in flight:", len(net.inFlight()))
+            testPacket.printSummary()
+    print(endMsg)
+
+def trace_test1(): #basic_test1 traced to a binary sink instead of logged
+    startMsg, endMsg = startEndTestMsg("Trace Test 1: Binary Trace of a Simple Network")
+    print(startMsg)
+
+    nodes, d = setupBasic()
+    net = Network(40, engine=EVENT)
+    net.changeTopology_nnal(nodes, d)
+    net.setTraceSink(TraceSink(1024))
+    testPacket = Packet("a", "e")
+    net.send(testPacket)
+    net.updateTickN(100)
+    reader = TraceReader.fromSink(net.getTraceSink())
+    reader.printLog(testPacket.packetID)
+    reader.printSummary(testPacket.packetID)
+    print(endMsg)
+
+def trace_test2(): #routers come and go between packets, so their indices are reused
+    startMsg, endMsg = startEndTestMsg("Trace Test 2: Probers Added and Removed")
+    print(startMsg)
+
+    nodes, d = setupBasic()
+    net = Network(40, engine=EVENT)
+    net.changeTopology_nnal(nodes, d)
+    net.setTraceSink(TraceSink(1024))
+    packets = []
+    for i in range(2):
+        p1, p2 = Router("proberA" + str(i)), Router("proberB" + str(i))
+        net.addNode(p1)
+        net.addNode(p2)
+        net.setLink(Link(p1.getIP(), net.getNodeIP("a"), 0))
+        net.setLink(Link(p2.getIP(), net.getNodeIP("e"), 0))
+        packets.append(Packet(p1.getName(), p2.getName()))
+        net.send(packets[-1])
+        net.updateTickN(100)
+        net.removeNode(p1)
+        net.removeNode(p2)
+    reader = TraceReader.fromSink(net.getTraceSink())
+    for p in packets:
+        p.printSummary()
+        reader.printSummary(p.packetID)
+    print(endMsg)
+
+def traffic_test1(): #poisson load on a random graph
+    startMsg, endMsg = startEndTestMsg("Traffic Test 1: Poisson Load")
+    print(startMsg)
+    nodes, d = generateConnectedRandomGraph(50, 10, 0.1)
+    net = Network(200, engine=EVENT)
+    net.changeTopology_nnal(nodes, d)
+    net.enableStats()
+    net.scheduleTraffic(poissonTraffic(nodes, 5.0, 100, retransmit=False))
+    net.updateTickN(400)
+    stats = net.getStats()
+    print("Hops delivered:", stats['hopsDelivered'], "Dropped:", stats['dropped'], "Peak ACK buffer:", stats['maxAwaitingAck'])
+    print(endMsg)
+
+def traffic_test2(): #poisson load with retransmits: timed out packets are sent again the way they first went
+    startMsg, endMsg = startEndTestMsg("Traffic Test 2: Poisson Load, Retransmits")
+    print(startMsg)
+    nodes, d = generateConnectedRandomGraph(50, 10, 0.1)
+    net = Network(200, engine=EVENT)
+    net.changeTopology_nnal(nodes, d)
+    net.enableStats()
+    net.scheduleTraffic(poissonTraffic(nodes, 2.0, 100))
+    net.updateTickN(600)
+    stats = net.getStats()
+    print("Hops delivered:", stats['hopsDelivered'], "Dropped:", stats['dropped'], "Retransmitted:", stats['retransmitted'])
+    print(endMsg)
+
+def probe_trial(seed: int, n: int = 30, connectivity: float = 0.3): #one silent run of probe_test2
+    nodes, d = generateConnectedRandomGraph(n, 10, connectivity, seed)
+    net = Network(50, seed=seed)
+    net.changeTopology_nnal(nodes, d)
+    maliciousNode = Attacker('node-mal', 5)
+    net.addNode(maliciousNode)
+    net.triggerNodesExplore()
+    res = sendTestPacket(net, verbose=False)
+    return {'identified': None if res == None else res.getName(), 
+            'correct': res is maliciousNode, 'ticks': net.getTime()}
+
+def monte_carlo_test1(trials: int = 16): #probe_trial over many seeds, in parallel
+    startMsg, endMsg = startEndTestMsg("Monte Carlo Test 1: Randomized Probing Accuracy")
+    print(startMsg)
+    correct = 0
+    for seed, res in runTrials(probe_trial, range(trials)):
+        print("Seed", seed, res)
+        correct += res['correct']
+    print("\nAccuracy:", correct / trials)
+    print(endMsg)
+
+def fork_test1(): #probing on forks leaves the network as it was
+    startMsg, endMsg = startEndTestMsg("Fork Test 1: Probing on Copies")
+    print(startMsg)
+    nodes, d = generateConnectedRandomGraph(50, 10, 0.2)
+    net = Network(50, seed=1)
+    net.changeTopology_nnal(nodes, d)
+    maliciousNode = Attacker('node-mal', 5)
+    net.addNode(maliciousNode)
+    net.triggerNodesExplore()
+    net.save("fork_test1.bin")
+    dropped = None
+    while dropped == None:
+        p = Packet(net.getRandomNode(False).getName(), net.getRandomNode(False).getName(), retransmit=False)
+        net.send(p)
+        net.updateTickN(100)
+        if p.getStatus() == DROP: dropped = p
+    t, numNodes = net.getTime(), net.numNodes
+    res = identifyDropperBasic(net, dropped, fork=True)
+    print("Identified", res, "actual", maliciousNode)
+    print("Time and routers unchanged:", (t, numNodes) == (net.getTime(), net.numNodes))
+    print("Restored at time", Network.load("fork_test1.bin").getTime())
+    os.remove("fork_test1.bin")
+    print(endMsg)
+
+def lazy_test1(): #routes computed only for the routers traffic goes through
+    startMsg, endMsg = startEndTestMsg("Lazy Test 1: On Demand Routes")
+    print(startMsg)
+    for n, budget in ((3000, None), (3000, 1 << 24), (30000, 1 << 26)):
+        nodes, src, dst, weights = erdosRenyi(n, 4, seed=0)
+        net = Network(1000, engine=EVENT, seed=0)
+        net.setRouteStore(lazyBudget=budget)
+        t0 = time.perf_counter()
+        net.changeTopology_ea(nodes, src, dst, weights)
+        setup = time.perf_counter() - t0
+        packets = [Packet(a, b, retransmit=False) for a, b in zip(nodes[:5], nodes[-5:])]
+        for p in packets:
+            net.send(p)
+        t0 = time.perf_counter()
+        net.updateTickN(200)
+        print(n, "Lazy" if budget else "Eager", "setup: {:.3f}s".format(setup), 
+              "traffic: {:.3f}s".format(time.perf_counter() - t0), 
+              "delivered:", sum(p.getStatus() == RECV for p in packets))
+    print(endMsg)
+
+def cache_test1(): #trials on one topology compute its routes once
+    startMsg, endMsg = startEndTestMsg("Cache Test 1: Routes Cached on Disk")
+    print(startMsg)
+    nodes, src, dst, weights = erdosRenyi(1000, 4, seed=0)
+    for trial in range(3):
+        net = Network(1000, seed=trial)
+        net.setRouteCache("cache_test1")
+        net.enableStats()
+        t0 = time.perf_counter()
+        net.changeTopology_ea(nodes, src, dst, weights)
+        print("Trial", trial, "setup: {:.3f}s".format(time.perf_counter() - t0), 
+              "from cache:", net.getStats()['routeCacheHits'] > 0)
+    shutil.rmtree("cache_test1")
+    print(endMsg)
+
+def load_test1(): #bulk loaders should build the network changeTopology_nnal builds
+    startMsg, endMsg = startEndTestMsg("Load Test 1: Bulk Loaders Against nnal")
+    print(startMsg)
+    nodes, src, dst, weights = erdosRenyi(300, 4, seed=0)
+    ref = Network()
+    ref.changeTopology_nnal(nodes, edgesToAdjacency(nodes, src, dst, weights))
+    expected = nextHops(ref)
+    ###the same graph as an edge list file, a GraphML file and CSR arrays
+    with open("load_test1.txt", 'w') as f:
+        f.write("# u v weight\n")
+        for u, v, w in zip(src.tolist(), dst.tolist(), weights.tolist()):
+            f.write(f"{nodes[u]},{nodes[v]},{w}\n")
+    with open("load_test1.graphml", 'w') as f:
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        f.write('<key id="w" for="edge" attr.name="weight" attr.type="double"/>\n<graph edgedefault="undirected">\n')
+        for u, v, w in zip(src.tolist(), dst.tolist(), weights.tolist()):
+            f.write(f'<edge source="{nodes[u]}" target="{nodes[v]}"><data key="w">{w}</data></edge>\n')
+        f.write('</graph>\n</graphml>\n')
+    order = np.argsort(src, kind='stable')
+    indptr = np.searchsorted(src[order], np.arange(len(nodes) + 1))
+    builds = {
+        'changeTopology_ea': lambda net: net.changeTopology_ea(nodes, src, dst, weights),
+        'changeTopology_csr': lambda net: net.changeTopology_csr(indptr, dst[order], weights[order], nodes),
+        'loadEdgeList': lambda net: net.changeTopology_ea(*loadEdgeList("load_test1.txt")),
+        'loadGraphML': lambda net: net.changeTopology_ea(*loadGraphML("load_test1.graphml")),
+    }
+    for name, build in builds.items():
+        net = Network(40)
+        build(net)
+        testPacket = Packet(nodes[0], nodes[-1])
+        net.send(testPacket)
+        net.updateTickTill(testPacket, RECV, 200)
+        print(name, "- routers:", net.numNodes, "same next hops:", nextHops(net) == expected, 
+              "round trip:", testPacket.getStatus() == RECV)
+    os.remove("load_test1.txt")
+    os.remove("load_test1.graphml")
+    print(endMsg)
+
+def store_test1(): #compressed and memory mapped route stores should route as the dense one
+    startMsg, endMsg = startEndTestMsg("Store Test 1: Route Stores Against Dense")
+    print(startMsg)
+    stores = {
+        'compressed': (None, True),
+        'memory mapped': (os.path.join("store_test1", "mapped"), False),
+        'memory mapped, compressed': (os.path.join("store_test1", "compressed"), True),
+    }
+    for topology, (nodes, src, dst, weights) in (("grid", grid(20, 20, maxW=3, seed=0)), 
+                                                  ("random", erdosRenyi(400, 4, seed=0))):
+        nets = {'dense': Network()}
+        for name, (path, compressed) in stores.items():
+            nets[name] = Network()
+            nets[name].setRouteStore(path, compressed)
+        for net in nets.values():
+            net.changeTopology_ea(nodes, src, dst, weights)
+        expected = nextHops(nets['dense'])
+        for name in stores:
+            print(topology, name, "- same next hops:", nextHops(nets[name]) == expected)
+        ###reweighting links only recomputes the rows they affect, in every store
+        for net in nets.values():
+            net.beginTopologyEdit()
+            for k in range(0, len(src), 7):
+                ips = (net.getNodeIP(nodes[src[k]]), net.getNodeIP(nodes[dst[k]]))
+                net.setLink(Link(*ips, weights[k] + 5))
+            net.commitTopologyEdit()
+        expected = nextHops(nets['dense'])
+        for name in stores:
+            print(topology, name, "after reweighting - same next hops:", nextHops(nets[name]) == expected)
+    shutil.rmtree("store_test1")
+    print(endMsg)
+
+def retention_test1(): #bounded routers should answer as unbounded ones, with the trace for evicted hops
+    startMsg, endMsg = startEndTestMsg("Retention Test 1: Bounded Hop Records")
+    print(startMsg)
+    nodes, src, dst, weights = erdosRenyi(50, 4, seed=0)
+    rng = random.Random(0)
+    pairs = [tuple(rng.sample(nodes, 2)) for _ in range(2000)]
+    runs = {}
+    for name, window, cap in (('unbounded', None, None), ('bounded', 50, 200)):
+        net = Network(1000, engine=EVENT, seed=0)
+        net.setRetention(window, cap, spill=True)
+        net.setTraceSink(TraceSink(1 << 20))
+        net.changeTopology_ea(nodes, src, dst, weights)
+        packets = [Packet(a, b, retransmit=False) for a, b in pairs]
+        for i, p in enumerate(packets):
+            net.scheduleSend(p, 1 + i // 5)
+        net.updateTickN(600)
+        runs[name] = (net, packets, TraceReader.fromSink(net.getTraceSink()))
+    def reportHops(name, i): #(what the routers still hold, that or else what the trace has)
+        net, packets, reader = runs[name]
+        held = [r.reportHop(packets[i]) for r in net.getNodes()]
+        return held, [hop if hop != None else reader.reportHop(packets[i].packetID, r.getName()) 
+                      for hop, r in zip(held, net.getNodes())]
+    held = {name: 0 for name in runs}
+    answered = {name: 0 for name in runs}
+    mismatches = 0
+    for i in range(0, len(pairs), 10):
+        found = {}
+        for name in runs:
+            h, found[name] = reportHops(name, i)
+            held[name] += sum(hop != None for hop in h)
+            answered[name] += sum(hop != None for hop in found[name])
+        mismatches += sum(a != b for a, b in zip(found['unbounded'], found['bounded']))
+    for name in runs:
+        print(name, "- hops held by routers:", held[name], "reported with the trace:", answered[name])
+    print("Hops reported differently:", mismatches)
+    net = runs['bounded'][0]
+    before = (len(net.getNodeNames()), len(net.getLinkEnds()))
+    for _ in range(20):
+        testRouter(net, nodes[0])
+    print("Router and link indices before and after 20 probes:", before, 
+          (len(net.getNodeNames()), len(net.getLinkEnds())))
+    print(endMsg)
+
 # basic_test1()
 # basic_test2()
 # basic_test3()
@@ -257,6 +627,22 @@ def random_path_test1():
 # probe_test1()
 # probe_test2()
 # probe_test3()
+# probe_test4()
 
 # random_path_test1()
+# random_path_test2()
+
+# event_test1()
+# event_test2()
+# trace_test1()
+# trace_test2()
+# traffic_test1()
+# traffic_test2()
 
+# monte_carlo_test1()
+# fork_test1()
+# lazy_test1()
+# cache_test1()
+# load_test1()
+# store_test1()
+# retention_test1()
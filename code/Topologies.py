@@ -0,0 +1,204 @@
+# Topologies as edge arrays (names, src, dst, weights) for Network.changeTopology_ea
+from array import array
+import xml.etree.ElementTree as ET
+import numpy as np
+from NetworkObjects import CustomError
+
+def _edgeArrays(index: dict, src: array, dst: array, weights: array):
+    return (list(index), np.frombuffer(src, dtype=np.int64),
+            np.frombuffer(dst, dtype=np.int64), np.frombuffer(weights, dtype=np.float64))
+
+#region loaders
+def loadEdgeList(path: str, defaultWeight: float = 1):
+    """
+    Streams an edge list file with one 'u v [weight]' line per link,
+    separated by spaces, tabs or commas. Lines starting with # are skipped.
+    Routers are indexed in the order they first appear.
+    """
+    index = {}
+    src, dst, weights = array('q'), array('q'), array('d')
+    with open(path) as f:
+        for line in f:
+            fields = line.replace(',', ' ').split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            src.append(index.setdefault(fields[0], len(index)))
+            dst.append(index.setdefault(fields[1], len(index)))
+            weights.append(float(fields[2]) if len(fields) > 2 else defaultWeight)
+    return _edgeArrays(index, src, dst, weights)
+
+def loadGraphML(path: str, weightAttr: str = 'weight', defaultWeight: float = 1):
+    """
+    Streams a GraphML file. Node ids become router names and the edge attribute
+    named weightAttr, if declared, the link weight.
+    """
+    index = {}
+    src, dst, weights = array('q'), array('q'), array('d')
+    weightKey = None
+    for _, elem in ET.iterparse(path, events=('end',)):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag == 'key' and elem.get('attr.name') == weightAttr and elem.get('for') in ('edge', 'all'):
+            weightKey = elem.get('id')
+        elif tag == 'node':
+            index.setdefault(elem.get('id'), len(index))
+            elem.clear()
+        elif tag == 'edge':
+            w = defaultWeight
+            for data in elem:
+                if data.get('key') == weightKey and data.text:
+                    w = float(data.text)
+            src.append(index.setdefault(elem.get('source'), len(index)))
+            dst.append(index.setdefault(elem.get('target'), len(index)))
+            weights.append(w)
+            elem.clear()
+    return _edgeArrays(index, src, dst, weights)
+#endregion
+
+#region generators
+def _weights(rng, count: int, maxW: int):
+    return rng.integers(1, maxW + 1, count).astype(np.float64)
+
+def _dedupe(src, dst):
+    """Drops self loops and repeated pairs, in either direction."""
+    keep = src != dst
+    u, v = np.minimum(src[keep], dst[keep]), np.maximum(src[keep], dst[keep])
+    pairs = np.unique(np.stack((u, v), axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+def _components(n: int, src, dst):
+    """Component label (smallest member) of every node, by min label propagation."""
+    labels = np.arange(n)
+    while True:
+        old = labels.copy()
+        np.minimum.at(labels, src, labels[dst])
+        np.minimum.at(labels, dst, labels[src])
+        labels = labels[labels] #pointer jumping
+        if np.array_equal(labels, old):
+            return labels
+
+def _connect(n: int, src, dst, rng):
+    """Joins every component to a random node of the first one, so the graph is connected."""
+    labels = _components(n, src, dst)
+    roots = np.unique(labels)
+    if len(roots) == 1:
+        return src, dst
+    # a random member of each component, in the order of roots
+    perm = rng.permutation(n)
+    _, first = np.unique(labels[perm], return_index=True)
+    members = perm[first]
+    extraSrc = rng.choice(np.flatnonzero(labels == roots[0]), len(roots) - 1)
+    return np.concatenate((src, extraSrc)), np.concatenate((dst, members[1:]))
+
+def _names(n: int, prefix: str = "node"):
+    return [prefix + str(i) for i in range(n)]
+
+def erdosRenyi(n: int, degree: float, maxW: int = 10, seed: int = None):
+    """Connected G(n, p) with p = degree / (n - 1), made connected by one extra link per stray component."""
+    rng = np.random.default_rng(seed)
+    p = min(1.0, degree / max(n - 1, 1))
+    m = rng.binomial(n * (n - 1) // 2, p)
+    src, dst = _dedupe(rng.integers(0, n, m), rng.integers(0, n, m))
+    src, dst = _connect(n, src, dst, rng)
+    return _names(n), src, dst, _weights(rng, len(src), maxW)
+
+def barabasiAlbert(n: int, m: int = 2, maxW: int = 10, seed: int = None):
+    """Preferential attachment: each new router links to up to m routers picked in proportion to their degree."""
+    rng = np.random.default_rng(seed)
+    m = max(1, min(m, n - 1))
+    # every link end so far, so that a uniform pick is a degree proportional one
+    ends = np.empty(2 * m * n, dtype=np.int64)
+    src, dst = [np.arange(1, m + 1)], [np.zeros(m, dtype=np.int64)] #a star to start from
+    ends[:2 * m] = np.concatenate((src[0], dst[0]))
+    count = 2 * m
+    for t in range(m + 1, n):
+        targets = np.unique(ends[rng.integers(0, count, m)])
+        k = len(targets)
+        src.append(np.full(k, t))
+        dst.append(targets)
+        ends[count:count + k] = t
+        ends[count + k:count + 2 * k] = targets
+        count += 2 * k
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    return _names(n), src, dst, _weights(rng, len(src), maxW)
+
+def waxman(n: int, alpha: float = 0.4, beta: float = 0.1, maxW: int = 10,
+           cutoff: float = 1e-4, seed: int = None):
+    """
+    Routers at random points of the unit square, linked with probability 
+    alpha * exp(-d / (beta * sqrt(2))). Pairs whose probability is below cutoff are 
+    never tried: points are bucketed in cells of that distance and only neighbouring 
+    cells are compared. Made connected like erdosRenyi.
+    """
+    rng = np.random.default_rng(seed)
+    xy = rng.random((n, 2))
+    scale = beta * np.sqrt(2)
+    radius = scale * np.log(alpha / cutoff) if alpha > cutoff else 0.0
+    g = max(1, min(int(1 / radius) if radius > 0 else n, int(np.sqrt(n)) + 1))
+    cells = np.minimum((xy * g).astype(np.int64), g - 1)
+    cid = cells[:, 0] * g + cells[:, 1]
+    order = np.argsort(cid, kind='stable')
+    counts = np.bincount(cid, minlength=g * g)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    src, dst = [], []
+    cx, cy = np.divmod(np.arange(g * g), g)
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        ok = (cx + dx >= 0) & (cx + dx < g) & (cy + dy >= 0) & (cy + dy < g)
+        a = np.flatnonzero(ok)
+        b = (cx[a] + dx) * g + cy[a] + dy
+        ca, cb = counts[a], counts[b]
+        sizes = ca * cb
+        rep = np.repeat(np.arange(len(a)), sizes)
+        within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        i = order[starts[a][rep] + within // cb[rep]]
+        j = order[starts[b][rep] + within % cb[rep]]
+        if dx == 0 and dy == 0:
+            i, j = i[i < j], j[i < j]
+        d = np.linalg.norm(xy[i] - xy[j], axis=1)
+        hit = rng.random(len(d)) < alpha * np.exp(-d / scale)
+        src.append(i[hit])
+        dst.append(j[hit])
+    src, dst = _connect(n, np.concatenate(src), np.concatenate(dst), rng)
+    return _names(n), src, dst, _weights(rng, len(src), maxW)
+
+def grid(rows: int, cols: int, torus: bool = False, maxW: int = 1, seed: int = None):
+    """Routers named r<row>c<col>, each linked to its right and lower neighbours (wrapping around if torus)."""
+    rng = np.random.default_rng(seed)
+    idx = np.arange(rows * cols).reshape(rows, cols)
+    right = (idx, np.roll(idx, -1, axis=1)) if torus else (idx[:, :-1], idx[:, 1:])
+    down = (idx, np.roll(idx, -1, axis=0)) if torus else (idx[:-1, :], idx[1:, :])
+    src = np.concatenate((right[0].ravel(), down[0].ravel()))
+    dst = np.concatenate((right[1].ravel(), down[1].ravel()))
+    src, dst = _dedupe(src, dst) #small tori wrap onto existing links
+    names = [f"r{r}c{c}" for r in range(rows) for c in range(cols)]
+    return names, src, dst, _weights(rng, len(src), maxW)
+
+def fatTree(k: int, hosts: bool = True, maxW: int = 1, seed: int = None):
+    """
+    k-ary fat-tree (k even): (k/2)^2 core switches and k pods of k/2 aggregation 
+    and k/2 edge switches, plus k/2 hosts under every edge switch if hosts.
+    """
+    if k % 2:
+        raise CustomError("Fat-tree arity has to be even")
+    rng = np.random.default_rng(seed)
+    h = k // 2
+    names = [f"core{i}" for i in range(h * h)]
+    agg = lambda pod, i: h * h + pod * k + i
+    edge = lambda pod, i: h * h + pod * k + h + i
+    for pod in range(k):
+        names += [f"agg{pod}_{i}" for i in range(h)] + [f"edge{pod}_{i}" for i in range(h)]
+    src, dst = [], []
+    for pod in range(k):
+        for i in range(h):
+            for j in range(h):
+                src += [agg(pod, i), agg(pod, i)]
+                dst += [i * h + j, edge(pod, j)] #core switches i*h .. i*h+h-1 hang off agg i
+    if hosts:
+        for pod in range(k):
+            for i in range(h):
+                for j in range(h):
+                    src.append(edge(pod, i))
+                    dst.append(len(names))
+                    names.append(f"host{pod}_{i}_{j}")
+    src, dst = np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64)
+    return names, src, dst, _weights(rng, len(src), maxW)
+#endregion
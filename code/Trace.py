@@ -0,0 +1,236 @@
+# Binary event trace for long runs
+import json
+import numpy as np
+from NetworkObjects import *
+
+# One fixed width record per packet event
+TRACE_DTYPE = np.dtype([
+    ('time', np.int64),
+    ('packetID', np.int64),
+    ('src', np.int32),      # router index of the packet's source at that time
+    ('dst', np.int32),      # router index of the packet's destination at that time
+    ('where', np.int32),    # router or link index, see kind
+    ('arg', np.int32),      # next hop router index for HOP records, -1 otherwise
+    # indices are the sink's own, see TraceSink
+    ('code', np.uint16),    # index of the message template
+    ('status', np.uint8),
+    ('kind', np.uint8),
+])
+
+# Record kinds
+AT_ROUTER = 0
+AT_LINK = 1
+HOP = 2     # a hop record evicted from a router, see Network.setRetention
+
+# Templates the simulator logs with, so codes are stable across runs
+TRACE_TEMPLATES = [
+    "At {}.",
+    "Packet added to {}",
+    "Packet sent.",
+    "Dropped random ACK'd packet.",
+    "Routing a random ACK'd packet.",
+    "Round trip completed.",
+    "Packet received.",
+    "Packet dropped by {}.",
+    "Packet dropped by source, stopped logging at {}",
+    "At link {}",
+    "Next hop recorded at {}.",
+]
+
+class TraceSink:
+    """
+    Network wide ring buffer of TRACE_DTYPE records, preallocated in memory
+    or memory mapped to a file. Once full, the oldest records are overwritten.
+    Only packets picked at send time are traced: the given flows,
+    one in sampleEvery packet ids, or all of them if neither is given.
+    Message arguments are assumed to be the router or link doing the logging.
+    Routers and links are numbered by the sink in the order it first records them, 
+    not by the network, whose indices are reused once a router or link is removed.
+    """
+    def __init__(self, capacity: int = 1 << 20, path: str = None,
+                 flows: set = None, sampleEvery: int = None):
+        self.capacity = capacity
+        self.path = path
+        self.flows = None if flows == None else set(flows)
+        self.sampleEvery = sampleEvery
+        if path == None:
+            self.__buf = np.zeros(capacity, dtype=TRACE_DTYPE)
+        else:
+            self.__buf = np.memmap(path, dtype=TRACE_DTYPE, mode='w+', shape=(capacity,))
+        self.__count = 0
+        self.__templates = list(TRACE_TEMPLATES)
+        self.__codes = {t: i for i, t in enumerate(self.__templates)}
+        self.__network = None
+        self.__nodeNames = []
+        self.__nodeIndex = {} #name -> index in nodeNames
+        self.__linkEnds = []
+        self.__linkIndex = {} #names of the ends -> index in linkEnds
+
+    def attach(self, network: Network):
+        self.__network = network
+
+    def wants(self, packet: Packet) -> bool:
+        if self.flows != None and (packet.src, packet.dst) in self.flows:
+            return True
+        if self.sampleEvery != None and packet.packetID % self.sampleEvery == 0:
+            return True
+        return self.flows == None and self.sampleEvery == None
+
+    def record(self, packet: Packet, who, msg: str):
+        code = self.__codes.get(msg)
+        if code == None:
+            code = self.__codes[msg] = len(self.__templates)
+            self.__templates.append(msg)
+        if type(who) == Link:
+            self.__append(self.__network.getTime(), packet, self.__linkOf(who), -1, code, AT_LINK)
+        else:
+            self.__append(self.__network.getTime(), packet, self.__indexOf(who.getName()), -1, code, AT_ROUTER)
+
+    def recordHop(self, packet: Packet, router: Router, nextHop: str, time: int):
+        """Keeps a hop record the router no longer holds, timed when it was recorded."""
+        arg = -1 if nextHop == None else self.__indexOf(nextHop)
+        self.__append(time, packet, self.__indexOf(router.getName()), arg, self.__codes["Next hop recorded at {}."], HOP)
+
+    def __append(self, time: int, packet: Packet, where: int, arg: int, code: int, kind: int):
+        self.__buf[self.__count % self.capacity] = (
+            time, packet.packetID, self.__indexOf(packet.src), self.__indexOf(packet.dst),
+            where, arg, code, packet.getStatus(), kind)
+        self.__count += 1
+
+    def __indexOf(self, name: str) -> int:
+        i = self.__nodeIndex.get(name)
+        if i == None:
+            i = self.__nodeIndex[name] = len(self.__nodeNames)
+            self.__nodeNames.append(name)
+        return i
+
+    def __linkOf(self, link: Link) -> int:
+        u, v = link.getEndpoints()
+        key = (u.getName(), v.getName())
+        i = self.__linkIndex.get(key)
+        if i == None:
+            i = self.__linkIndex[key] = len(self.__linkEnds)
+            self.__linkEnds.append((self.__indexOf(key[0]), self.__indexOf(key[1])))
+        return i
+
+    def __len__(self):
+        return min(self.__count, self.capacity)
+
+    def getRecords(self):
+        """Records still in the buffer, oldest first."""
+        if self.__count <= self.capacity:
+            return self.__buf[:self.__count].copy()
+        start = self.__count % self.capacity
+        return np.concatenate((self.__buf[start:], self.__buf[:start]))
+
+    def getTemplates(self) -> list[str]:
+        return self.__templates.copy()
+
+    def getNetwork(self):
+        return self.__network
+
+    def getNodeNames(self) -> list[str]:
+        return self.__nodeNames.copy()
+
+    def getLinkEnds(self) -> list[tuple[int, int]]:
+        """Router indices of the ends of each link, as the sink numbers them."""
+        return self.__linkEnds.copy()
+
+    def flush(self):
+        """Writes the buffer out and, next to it, what a TraceReader needs to decode it."""
+        if self.path == None:
+            raise CustomError("Trace sink is not backed by a file!")
+        self.__buf.flush()
+        with open(self.path + '.json', 'w') as f:
+            json.dump({'capacity': self.capacity, 'count': self.__count,
+                       'templates': self.__templates,
+                       'nodeNames': self.__nodeNames,
+                       'linkEnds': self.__linkEnds}, f)
+
+
+class TraceReader:
+    """Turns a trace back into the output of Packet.printLog and Packet.printSummary."""
+    def __init__(self, records, templates: list[str],
+                 nodeNames: list[str], linkEnds: list[tuple[int, int]]):
+        self.records = records
+        self.templates = templates
+        self.nodeNames = nodeNames
+        self.linkEnds = linkEnds
+
+    @staticmethod
+    def fromSink(sink: TraceSink):
+        return TraceReader(sink.getRecords(), sink.getTemplates(),
+                           sink.getNodeNames(), sink.getLinkEnds())
+
+    @staticmethod
+    def fromFile(path: str):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        buf = np.memmap(path, dtype=TRACE_DTYPE, mode='r', shape=(meta['capacity'],))
+        count, capacity = meta['count'], meta['capacity']
+        if count <= capacity:
+            records = buf[:count]
+        else:
+            start = count % capacity
+            records = np.concatenate((buf[start:], buf[:start]))
+        return TraceReader(records, meta['templates'], meta['nodeNames'],
+                           [tuple(e) for e in meta['linkEnds']])
+
+    def packetIDs(self):
+        return np.unique(self.records['packetID'])
+
+    def packetRecords(self, packetID: int):
+        """Log records of the packet, without hop records."""
+        recs = self.records
+        return recs[(recs['packetID'] == packetID) & (recs['kind'] != HOP)]
+
+    def reportHop(self, packetID: int, routerName: str) -> str:
+        """Last next hop spilled for the packet at the router, None if there is none."""
+        recs = self.records
+        recs = recs[(recs['packetID'] == packetID) & (recs['kind'] == HOP)]
+        recs = recs[np.isin(recs['where'], [i for i, n in enumerate(self.nodeNames) if n == routerName])]
+        if not len(recs) or recs[-1]['arg'] < 0:
+            return None
+        return self.nodeNames[recs[-1]['arg']]
+
+    def __where(self, r):
+        if r['kind'] == AT_LINK:
+            u, v = self.linkEnds[r['where']]
+            return f"Link({self.nodeNames[u]} <-> {self.nodeNames[v]})"
+        return f"Router({self.nodeNames[r['where']]})"
+
+    def __message(self, r):
+        msg = self.templates[r['code']]
+        return msg.format(*[self.__where(r)] * msg.count('{}'))
+
+    def __describe(self, r):
+        return describePacket(self.nodeNames[r['src']], self.nodeNames[r['dst']],
+                              Status(r['status']), int(r['packetID']))
+
+    def logLines(self, packetID: int) -> list[str]:
+        return [formatLogLine(int(r['time']), self.__describe(r), self.__where(r), self.__message(r))
+                for r in self.packetRecords(packetID)]
+
+    def printLog(self, packetID: int):
+        for line in self.logLines(packetID):
+            print(line)
+
+    def printSummary(self, packetID: int):
+        recs = self.packetRecords(packetID)
+        if not len(recs):
+            print("No trace for packet", packetID)
+            return
+        first, last, timeSent, timeStamp = None, None, -1000000, -1000000
+        visited = []
+        for r in recs:
+            status = Status(r['status'])
+            if r['kind'] == AT_ROUTER:
+                timeStamp = int(r['time'])
+                if status not in (DROP, FRESH, PROCESSED):
+                    visited.append(self.nodeNames[r['where']])
+            if status == PROCESSED:
+                first = self.__message(r)
+                timeSent = int(r['time'])
+            if status == DROP or status == RECV:
+                last = self.__message(r)
+        printSummary(self.__describe(recs[-1]), first, visited, last, timeSent, timeStamp)
@@ -0,0 +1,86 @@
+# Bulk traffic workloads for Network.scheduleTraffic
+import csv
+from array import array
+import numpy as np
+from NetworkObjects import *
+
+class TrafficBatch:
+    """
+    Future sends kept as arrays sorted by release time: src and dst index into names.
+    Packets are only made when their tick comes.
+    """
+    def __init__(self, times, src, dst, names: list[str],
+                 logBit: bool = False, retransmit = True):
+        times = np.asarray(times, dtype=np.int64)
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.src = np.asarray(src, dtype=np.int32)[order]
+        self.dst = np.asarray(dst, dtype=np.int32)[order]
+        self.names = list(names)
+        self.logBit = logBit
+        self.retransmit = retransmit
+        self.__next = 0
+
+    def __len__(self):
+        """Sends not released yet."""
+        return len(self.times) - self.__next
+
+    def nextTime(self):
+        if self.__next == len(self.times):
+            return None
+        return int(self.times[self.__next])
+
+    def release(self, network: Network, time: int):
+        lo = self.__next
+        hi = int(np.searchsorted(self.times, time, side='right'))
+        names = self.names
+        for i, j in zip(self.src[lo:hi].tolist(), self.dst[lo:hi].tolist()):
+            network.send(Packet(names[i], names[j], self.logBit, retransmit=self.retransmit))
+        self.__next = hi
+
+def poissonTraffic(names: list[str], rate: float, duration: int, start: int = 1,
+                   seed: int = None, **batchArgs) -> TrafficBatch:
+    """Poisson arrivals of rate packets per tick over [start, start + duration), between uniformly random pairs."""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(rate, duration)
+    times = np.repeat(np.arange(start, start + duration), counts)
+    src = rng.integers(0, len(names), len(times))
+    dst = rng.integers(0, len(names) - 1, len(times))
+    dst += dst >= src #never to itself
+    return TrafficBatch(times, src, dst, names, **batchArgs)
+
+def matrixTraffic(names: list[str], matrix, duration: int, start: int = 1,
+                  seed: int = None, **batchArgs) -> TrafficBatch:
+    """matrix[i][j] is the mean number of packets per tick from names[i] to names[j],
+    sent at uniformly random ticks in [start, start + duration)."""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(np.asarray(matrix, dtype=float) * duration)
+    np.fill_diagonal(counts, 0)
+    i, j = np.nonzero(counts)
+    c = counts[i, j]
+    src = np.repeat(i, c)
+    dst = np.repeat(j, c)
+    times = rng.integers(start, start + duration, len(src))
+    return TrafficBatch(times, src, dst, names, **batchArgs)
+
+def gravityMatrix(weights, total: float):
+    """Traffic matrix of total packets per tick, split between pairs in proportion to weights[i] * weights[j]."""
+    w = np.asarray(weights, dtype=float)
+    m = np.outer(w, w)
+    np.fill_diagonal(m, 0)
+    return m * (total / m.sum())
+
+def csvTraffic(path: str, **batchArgs) -> TrafficBatch:
+    """Replays a CSV trace of time,src,dst rows, src and dst being router names. A header row is skipped."""
+    times, src, dst = array('q'), array('i'), array('i')
+    index = {}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip().lstrip('-').isdigit():
+                continue
+            t, u, v = row[0], row[1].strip(), row[2].strip()
+            times.append(int(t))
+            src.append(index.setdefault(u, len(index)))
+            dst.append(index.setdefault(v, len(index)))
+    return TrafficBatch(np.frombuffer(times, dtype=np.int64), np.frombuffer(src, dtype=np.int32),
+                        np.frombuffer(dst, dtype=np.int32), list(index), **batchArgs)